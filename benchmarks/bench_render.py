@@ -0,0 +1,54 @@
+"""Бенчмарк построения сообщений со статусом откатов.
+
+Показывает, что время построения растёт линейно с числом участников:
+время на одного участника должно оставаться примерно постоянным.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_render.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot1
+
+SIZES = [10, 100, 1000, 2000, 5000]
+
+def make_list_state(participants_count, rollback_ratio=0.7):
+    """Синтетический список: часть участников с откатами длиной больше превью"""
+    now = datetime.now()
+    list_data = bot1.ListState(
+        id="BENCH",
+        name="18:00 | 25.10.2025 | Бенчмарк | Сервер",
+        channel_id=1,
+        static_channel_id=2,
+        created_by="0",
+        guild_id=3,
+        created_at=now
+    )
+    for i in range(participants_count):
+        user_id = str(100000000000000000 + i)
+        has_rollback = (i % 10) < rollback_ratio * 10
+        list_data.participants[user_id] = bot1.Participant(
+            user_id, f"Участник {i}", has_rollback, now + timedelta(microseconds=i),
+            i // bot1.STATUS_CHUNK_SIZE + 1
+        )
+        if has_rollback:
+            list_data.rollbacks.append(bot1.Rollback(
+                user_id, f"Участник {i}", f"Откат участника {i}: " + "текст " * 40, now + timedelta(seconds=i)
+            ))
+    return list_data
+
+def main():
+    print(f"{'участников':>10} {'мс на сборку':>14} {'мкс на участника':>18}")
+    for size in SIZES:
+        list_data = make_list_state(size)
+        number = max(1, 20000 // size)
+        best = min(timeit.repeat(lambda: bot1.build_status_messages(list_data), number=number, repeat=5)) / number
+        print(f"{size:>10} {best * 1000:>14.3f} {best / size * 1e6:>18.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Набор микробенчмарков горячих путей хранилища и отрисовки.
+
+Измеряет get_list (из БД и из кэша), get_all_lists, replace_rollback,
+generate_participants_list, build_status_messages, update_status_message
+(без изменений и с одним изменённым откатом) и clean_rollback_text
+на списках от 10 до 5000 участников.
+
+Нужен локальный PostgreSQL (STORAGE_BACKEND=postgres): без DATABASE_URL бот
+подключается к базе rollback_bot на localhost (см. get_db_connect_kwargs).
+Подойдёт любой, например
+    docker run -d -p 5432:5432 -e POSTGRES_DB=rollback_bot -e POSTGRES_PASSWORD=password postgres:16
+Бенчмарк создаёт схему миграциями бота, пишет только в собственные серверы
+(guild_id от BENCH_GUILD_BASE) и удаляет свои данные по завершении.
+Discord заменён фальшивыми каналами в памяти, поэтому измеряется только
+работа самого бота.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_suite.py --output results.json
+Сравнение с результатами другого коммита:
+    python benchmarks/bench_suite.py --compare old.json --output new.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot1
+from psycopg2.extras import execute_values
+
+from bench_render import make_list_state
+
+SIZES = [10, 100, 1000, 2000, 5000]
+# Списков на каждом тестовом сервере: страница /list_all считает их все
+LISTS_PER_GUILD = 5
+# Заведомо меньше любого настоящего snowflake Discord
+BENCH_GUILD_BASE = 1000000
+BENCH_CHANNEL_ID = 1
+BENCH_STATIC_CHANNEL_ID = 2
+REPEAT = 5
+
+# Типичный ввод в модальном окне: HTML-теги, ссылки и лишние пробелы
+ROLLBACK_INPUT = ("<b>Откат</b>  https://example.com/clip?t=42   <i>заход с левого фланга</i>\n\n" * 25)[:2000]
+
+_message_ids = itertools.count(1)
+
+class FakeMessage:
+    def __init__(self, channel, content=None):
+        self.id = next(_message_ids)
+        self.channel = channel
+        self.content = content
+
+class FakePartialMessage:
+    def __init__(self, channel, message_id):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.rest_call()
+        self.channel.edits += 1
+        self.channel.messages[self.id].content = content
+
+    async def delete(self):
+        await self.channel.rest_call()
+        self.channel.deletes += 1
+        self.channel.messages.pop(self.id, None)
+
+class FakeChannel:
+    """Канал Discord в памяти: запоминает сообщения и считает запросы.
+
+    latency - задержка каждого запроса к каналу, с (используется в load_sim.py)
+    """
+
+    def __init__(self, channel_id, latency=0.0):
+        self.id = channel_id
+        self.mention = f"<#{channel_id}>"
+        self.latency = latency
+        self.messages = {}
+        self.sends = 0
+        self.edits = 0
+        self.deletes = 0
+
+    async def rest_call(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send(self, content=None, **kwargs):
+        await self.rest_call()
+        self.sends += 1
+        message = FakeMessage(self, content)
+        self.messages[message.id] = message
+        return message
+
+    def get_partial_message(self, message_id):
+        return FakePartialMessage(self, message_id)
+
+def bench_guild_id(size):
+    return BENCH_GUILD_BASE + size
+
+def seed_guild(size):
+    """Создаёт на тестовом сервере LISTS_PER_GUILD списков по size участников"""
+    guild_id = bench_guild_id(size)
+    list_ids = []
+    for number in range(LISTS_PER_GUILD):
+        template = make_list_state(size)
+        list_id = f"B{size}_{number}"
+        list_ids.append(list_id)
+        with bot1.db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO lists (id, name, channel_id, static_channel_id, created_by, guild_id, created_at) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                (list_id, template.name, BENCH_CHANNEL_ID, BENCH_STATIC_CHANNEL_ID, "0", guild_id, template.created_at)
+            )
+            execute_values(cursor, """
+                INSERT INTO participants (list_id, user_id, display_name, has_rollback, registered_at, chunk_index) VALUES %s
+            """, [(list_id, p.user_id, p.display_name, p.has_rollback, p.registered_at, p.chunk_index)
+                  for p in template.participants.values()])
+            execute_values(cursor, """
+                INSERT INTO rollbacks (list_id, user_id, user_name, text, timestamp) VALUES %s
+            """, [(list_id, r.user_id, r.user_name, r.text, r.timestamp) for r in template.rollbacks])
+    return guild_id, list_ids
+
+def cleanup(sizes):
+    with bot1.db_connection() as conn:
+        conn.cursor().execute(
+            "DELETE FROM lists WHERE guild_id = ANY(%s)",
+            ([bench_guild_id(size) for size in sizes],)
+        )
+
+async def measure(func, number):
+    """Лучшее и медианное время одного вызова корутинной функции, микросекунды"""
+    samples = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        for _ in range(number):
+            await func()
+        samples.append((time.perf_counter() - started) / number * 1e6)
+    return min(samples), statistics.median(samples)
+
+def sync(func, *args):
+    async def call():
+        return func(*args)
+    return call
+
+async def run_size(size, results):
+    guild_id, list_ids = await bot1.run_db(seed_guild, size)
+    list_id = list_ids[0]
+    bot1.guild_configs[guild_id] = bot1.GuildConfig(guild_id, BENCH_STATIC_CHANNEL_ID)
+
+    async def get_list_cold():
+        bot1.list_cache.invalidate(list_id)
+        await bot1.get_list(list_id, guild_id)
+
+    async def get_list_warm():
+        await bot1.get_list(list_id, guild_id)
+
+    list_data = await bot1.get_list(list_id, guild_id)
+    user_ids = itertools.cycle(list(list_data.participants))
+
+    async def replace_rollback():
+        await bot1.replace_rollback(list_id, next(user_ids), "Бенчмарк", "Новый откат")
+
+    # Первая отрисовка отправляет сообщения - дальше меряются правки
+    await bot1.update_status_message(list_data)
+    counter = itertools.count()
+
+    async def update_status_one_change():
+        list_data.rollbacks[-1].text = f"Изменённый откат {next(counter)}"
+        await bot1.update_status_message(list_data)
+
+    budget = max(1, 20000 // size)
+    db_budget = max(3, 2000 // size)
+    benchmarks = [
+        ("get_list_cold", get_list_cold, db_budget),
+        ("get_list_warm", get_list_warm, 1000),
+        ("get_all_lists", lambda: bot1.get_all_lists(guild_id), db_budget),
+        ("replace_rollback", replace_rollback, db_budget),
+        ("generate_participants_list", lambda: bot1.generate_participants_list(list_data), budget),
+        ("build_status_messages", sync(bot1.build_status_messages, list_data), budget),
+        ("update_status_message_unchanged", lambda: bot1.update_status_message(list_data), budget),
+        ("update_status_message_one_change", update_status_one_change, db_budget),
+    ]
+    for name, func, number in benchmarks:
+        best, median = await measure(func, number)
+        results.append({"benchmark": name, "size": size, "iterations": number * REPEAT,
+                        "best_us": round(best, 3), "median_us": round(median, 3)})
+        print(f"{name:>34} {size:>6} {best:>12.1f} {median:>12.1f}")
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, path):
+    with open(path, encoding="utf-8") as f:
+        previous = {(r["benchmark"], r["size"]): r for r in json.load(f)["results"]}
+    print(f"\nСравнение с {path} (медиана):")
+    for result in results:
+        old = previous.get((result["benchmark"], result["size"]))
+        if old is None:
+            continue
+        change = (result["median_us"] / old["median_us"] - 1) * 100 if old["median_us"] else 0.0
+        size = "-" if result["size"] is None else result["size"]
+        print(f"{result['benchmark']:>34} {size:>6} {old['median_us']:>12.1f} -> "
+              f"{result['median_us']:>12.1f} ({change:+.1f}%)")
+
+async def main(args):
+    channel = FakeChannel(BENCH_STATIC_CHANNEL_ID)
+    bot1.bot.get_channel = lambda channel_id: channel if channel_id == BENCH_STATIC_CHANNEL_ID else None
+
+    if bot1.storage.name != "postgres":
+        sys.exit("Бенчмарк заполняет базу запросами PostgreSQL: нужен STORAGE_BACKEND=postgres")
+    bot1.storage.init()
+    await bot1.run_db(cleanup, args.sizes)
+    results = []
+    print(f"{'бенчмарк':>34} {'участ.':>6} {'лучшее, мкс':>12} {'медиана, мкс':>12}")
+    try:
+        best, median = await measure(sync(bot1.clean_rollback_text, ROLLBACK_INPUT), 2000)
+        results.append({"benchmark": "clean_rollback_text", "size": None, "iterations": 2000 * REPEAT,
+                        "best_us": round(best, 3), "median_us": round(median, 3)})
+        print(f"{'clean_rollback_text':>34} {'-':>6} {best:>12.1f} {median:>12.1f}")
+
+        for size in args.sizes:
+            await run_size(size, results)
+    finally:
+        await bot1.run_db(cleanup, args.sizes)
+        bot1.storage.close()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "discord_sends": channel.sends,
+            "discord_edits": channel.edits,
+        },
+        "results": results,
+    }
+    if args.compare:
+        compare(results, args.compare)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты записаны в {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="куда записать результаты в JSON")
+    parser.add_argument("--compare", help="JSON с результатами другого коммита для сравнения")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="размеры списков")
+    asyncio.run(main(parser.parse_args()))
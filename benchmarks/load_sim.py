@@ -0,0 +1,282 @@
+"""Нагрузочный симулятор: сотни пользователей одновременно нажимают кнопки одного списка.
+
+Воспроизводит начало события: администраторы регистрируют участников
+через /register_user, затем все участники разом нажимают «Отправить откат»,
+заполняют модальное окно, часть из них заменяет откат и нажимает «Обновить».
+Вызываются настоящие обработчики бота (register_user, диспетчер кнопок,
+RollbackModal.callback) с фальшивыми взаимодействиями, а REST Discord
+заменён заглушкой с задержкой --rest-latency, поэтому симулятор работает
+без сети.
+
+Отчёт: p50/p99 задержки подтверждения взаимодействия по типам, задержка
+цикла событий, число соединений с БД и запросов к Discord.
+
+Работает с любым хранилищем бота: локальным PostgreSQL (см. bench_suite.py)
+или встроенным SQLite. Симулятор создаёт один список и удаляет его по
+завершении. Запуск из корня репозитория:
+    python benchmarks/load_sim.py --users 300
+    STORAGE_BACKEND=sqlite SQLITE_PATH=/tmp/load_sim.db python benchmarks/load_sim.py --users 300
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot1
+
+from bench_suite import FakeChannel
+
+LIST_CHANNEL_ID = 10
+# Сколько пользователей администратор упоминает в одной команде /register_user
+REGISTER_BATCH = 25
+FIRST_USER_ID = 200000000000000000
+LOOP_LAG_INTERVAL = 0.01
+
+class Stats:
+    def __init__(self):
+        self.ack_latency = {}
+        self.loop_lag = []
+        self.db_open = 0
+        self.db_in_use = 0
+        self.responses = 0
+
+    def ack(self, kind, seconds):
+        self.ack_latency.setdefault(kind, []).append(seconds)
+
+stats = Stats()
+rest_latency = 0.0
+
+async def rest_call():
+    """Заглушка запроса к Discord REST"""
+    await asyncio.sleep(rest_latency)
+
+class FakeRole:
+    def __init__(self, role_id):
+        self.id = role_id
+
+class FakeMember:
+    def __init__(self, member_id, display_name, guild, roles=()):
+        self.id = member_id
+        self.display_name = display_name
+        self.guild = guild
+        self.roles = [FakeRole(role_id) for role_id in roles]
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.members = {}
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+class FakeComponent:
+    def __init__(self, custom_id):
+        self.custom_id = custom_id
+
+class FakeResponse:
+    """Ответ на взаимодействие: первый вызов считается подтверждением"""
+
+    def __init__(self, inter):
+        self.inter = inter
+
+    async def _respond(self):
+        await rest_call()
+        stats.responses += 1
+        if self.inter.acked_at is None:
+            self.inter.acked_at = time.perf_counter()
+            stats.ack(self.inter.kind, self.inter.acked_at - self.inter.started_at)
+
+    async def send_message(self, *args, **kwargs):
+        await self._respond()
+
+    async def edit_message(self, *args, **kwargs):
+        await self._respond()
+
+    async def defer(self, *args, **kwargs):
+        await self._respond()
+
+    async def send_modal(self, modal):
+        self.inter.modal = modal
+        await self._respond()
+
+class FakeInteraction:
+    _ids = itertools.count(1)
+
+    def __init__(self, kind, guild, author, custom_id=None, text_values=None):
+        self.id = next(self._ids)
+        self.kind = kind
+        self.guild = guild
+        self.guild_id = guild.id
+        self.author = author
+        self.channel_id = LIST_CHANNEL_ID
+        self.component = FakeComponent(custom_id)
+        self.text_values = text_values or {}
+        self.response = FakeResponse(self)
+        self.modal = None
+        self.started_at = time.perf_counter()
+        self.acked_at = None
+
+    async def edit_original_response(self, *args, **kwargs):
+        await rest_call()
+        stats.responses += 1
+
+def pick_admin(guild):
+    """Администратор из конфигурации: по ID или по роли"""
+    config = bot1.get_server_config(guild.id)
+    if config.admin_user_ids:
+        return FakeMember(min(config.admin_user_ids), "Администратор", guild)
+    return FakeMember(1, "Администратор", guild, roles=sorted(config.admin_role_ids)[:1])
+
+async def monitor(stop):
+    """Замеряет задержку цикла событий и соединения с БД"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        stats.loop_lag.append(time.perf_counter() - started - LOOP_LAG_INTERVAL)
+        connection_stats = bot1.storage.connection_stats()
+        stats.db_open = max(stats.db_open, connection_stats["open"])
+        stats.db_in_use = max(stats.db_in_use, connection_stats["in_use"])
+
+async def click(kind, guild, member, custom_id):
+    inter = FakeInteraction(kind, guild, member, custom_id=custom_id)
+    await bot1.dispatch_button_click(inter)
+    return inter
+
+async def submit_modal(guild, member, modal, text):
+    inter = FakeInteraction("modal:rollback", guild, member, text_values={"rollback_text": text})
+    await modal.callback(inter)
+    return inter
+
+async def user_session(guild, member, list_id, args):
+    """Один участник в начале события: откат, иногда замена и обновление"""
+    inter = await click("button:submit", guild, member, bot1.button_id("submit", list_id))
+    await asyncio.sleep(random.uniform(0, args.think))
+    await submit_modal(guild, member, inter.modal, f"<b>Откат</b> {member.display_name}: " + "текст " * 30)
+
+    if random.random() < args.replace_ratio:
+        await click("button:submit", guild, member, bot1.button_id("submit", list_id))
+        inter = await click("button:replace", guild, member, bot1.button_id("replace", list_id))
+        await asyncio.sleep(random.uniform(0, args.think))
+        await submit_modal(guild, member, inter.modal, f"Новый откат {member.display_name}")
+
+    if random.random() < args.refresh_ratio:
+        await click("button:refresh", guild, member, bot1.button_id("refresh", list_id))
+
+async def wait_for_renders():
+    while bot1._dirty_lists or bot1._render_tasks or bot1.outbox.pending():
+        await asyncio.sleep(0.05)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+async def main(args):
+    global rest_latency
+    rest_latency = args.rest_latency
+    random.seed(args.seed)
+
+    channels = {}
+    bot1.bot.get_channel = lambda channel_id: channels.setdefault(channel_id, FakeChannel(channel_id, rest_latency))
+    bot1.storage.init()
+    bot1.load_guild_configs()
+    
+    # Сервер из настроек бота, иначе проверка прав не пройдёт
+    guild = FakeGuild(next(iter(bot1.guild_configs)))
+    admin = pick_admin(guild)
+    members = [FakeMember(FIRST_USER_ID + i, f"Участник {i}", guild) for i in range(args.users)]
+    guild.members = {member.id: member for member in members}
+
+    list_id = f"SIM{random.randrange(10 ** 6)}"
+    list_data = await bot1.create_new_list(list_id, "Нагрузочный тест", LIST_CHANNEL_ID, str(admin.id), guild.id)
+
+    stop = asyncio.Event()
+    monitor_task = asyncio.create_task(monitor(stop))
+    started = time.perf_counter()
+    try:
+        registrations = []
+        for offset in range(0, args.users, REGISTER_BATCH):
+            batch = members[offset:offset + REGISTER_BATCH]
+            inter = FakeInteraction("slash:register_user", guild, admin)
+            users = " ".join(f"<@{member.id}>" for member in batch)
+            registrations.append(bot1.register_user.callback(inter, list_id=list_id, users=users))
+        await asyncio.gather(*registrations)
+        await wait_for_renders()
+        registered_at = time.perf_counter()
+
+        # Начало события: все нажимают одновременно
+        await asyncio.gather(*(user_session(guild, member, list_id, args) for member in members))
+        await wait_for_renders()
+        finished = time.perf_counter()
+    finally:
+        stop.set()
+        await monitor_task
+        await bot1.delete_list_from_db(list_id, guild.id)
+        bot1.storage.close()
+
+    list_data = bot1.list_cache.peek(list_id) or list_data
+    report = {
+        "users": args.users,
+        "storage": bot1.storage.name,
+        "rest_latency_ms": args.rest_latency * 1000,
+        "registration_seconds": round(registered_at - started, 3),
+        "event_seconds": round(finished - registered_at, 3),
+        "ack_latency_ms": {
+            kind: {
+                "count": len(values),
+                "p50": round(percentile(values, 0.5) * 1000, 1),
+                "p99": round(percentile(values, 0.99) * 1000, 1),
+                "max": round(max(values) * 1000, 1),
+            }
+            for kind, values in sorted(stats.ack_latency.items())
+        },
+        "loop_lag_ms": {
+            "p50": round(percentile(stats.loop_lag, 0.5) * 1000, 2),
+            "p99": round(percentile(stats.loop_lag, 0.99) * 1000, 2),
+            "max": round(max(stats.loop_lag, default=0) * 1000, 2),
+        },
+        "db_connections": {"max_open": stats.db_open, "max_in_use": stats.db_in_use},
+        "discord": {
+            "interaction_responses": stats.responses,
+            "sends": sum(channel.sends for channel in channels.values()),
+            "edits": sum(channel.edits for channel in channels.values()),
+            "deletes": sum(channel.deletes for channel in channels.values()),
+            "rate_limited": bot1.rate_limit_log.rate_limited,
+            "superseded": bot1.outbox.dropped,
+        },
+        "rollbacks": len(list_data.rollbacks),
+    }
+
+    print(f"Пользователей: {args.users}, хранилище: {bot1.storage.name}, задержка REST: {args.rest_latency * 1000:.0f} мс")
+    print(f"Регистрация: {report['registration_seconds']} с, событие: {report['event_seconds']} с")
+    print(f"{'взаимодействие':>22} {'кол-во':>7} {'p50, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+    for kind, values in report["ack_latency_ms"].items():
+        print(f"{kind:>22} {values['count']:>7} {values['p50']:>9} {values['p99']:>9} {values['max']:>9}")
+    lag = report["loop_lag_ms"]
+    print(f"Задержка цикла событий: p50 {lag['p50']} мс, p99 {lag['p99']} мс, max {lag['max']} мс")
+    db = report["db_connections"]
+    print(f"Соединения с БД: открыто до {db['max_open']}, занято до {db['max_in_use']}")
+    discord = report["discord"]
+    print(f"Discord: ответов {discord['interaction_responses']}, отправок {discord['sends']}, "
+          f"правок {discord['edits']}, удалений {discord['deletes']}, вытеснено {discord['superseded']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты записаны в {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=300, help="число участников")
+    parser.add_argument("--think", type=float, default=1.0, help="максимальное время заполнения модального окна, с")
+    parser.add_argument("--replace-ratio", type=float, default=0.3, help="доля участников, заменяющих откат")
+    parser.add_argument("--refresh-ratio", type=float, default=0.2, help="доля участников, нажимающих «Обновить»")
+    parser.add_argument("--rest-latency", type=float, default=0.05, help="задержка одного запроса к Discord, с")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора случайных чисел")
+    parser.add_argument("--output", help="куда записать результаты в JSON")
+    asyncio.run(main(parser.parse_args()))
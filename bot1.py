@@ -1,67 +1,308 @@
 import disnake
 from disnake.ext import commands, tasks
 from disnake import TextInputStyle
+from aiohttp import web
 import json
+import hashlib
+import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import re
 import random
 import string
+import socket
+import sqlite3
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import execute_values
 import urllib.parse
 import asyncio
+import bisect
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Optional
+from abc import ABC, abstractmethod
+
+# Экономный режим памяти: участники серверов не загружаются и не кэшируются
+# библиотекой целиком, имена нужных пользователей запрашиваются по требованию
+# (см. resolve_display_name). Событие изменения участника по-прежнему приходит
+LOW_MEMORY_MODE = os.getenv("LOW_MEMORY_MODE", "0") == "1"
 
 intents = disnake.Intents.default()
 intents.members = True
-intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents, help_command=None)
-
-# Конфигурация для разных серверов
-SERVER_CONFIGS = {
-    1429544000188317831: {
-        "static_channel_id": 1429831404379705474,
-        "admin_role_ids": [1310673963000528949, 1223589384452833290, 1429544345463296000],
-    },
-    1003525677640851496: {
-        "static_channel_id": 1429128623776075916,
-        "admin_ids": [1381084245321056438, 427922282959077386, 300627668460634124, 773983223595139083, 415145467702280192],
-    }
-}
+# Текст сообщений бот не читает
+intents.message_content = not LOW_MEMORY_MODE
+
+# Шардирование шлюза: SHARD_COUNT пуст - одно подключение, "auto" - число
+# шардов выбирает Discord, число - фиксированное количество шардов. SHARD_IDS
+# (через запятую) - шарды этого процесса, остальные запускают другие процессы
+SHARD_COUNT = os.getenv("SHARD_COUNT", "").strip().lower()
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id.strip()]
+# Бюджеты на каждый шард процесса, чтобы загруженный сервер не занимал
+# соединения с БД и перерисовку остальных. 0 - поровну делить DB_POOL_MAX
+DB_CONNECTIONS_PER_SHARD = int(os.getenv("DB_CONNECTIONS_PER_SHARD", "0"))
+RENDER_WORKERS_PER_SHARD = int(os.getenv("RENDER_WORKERS_PER_SHARD", "4"))
+
+# Несколько процессов бота над одной базой. Каждый процесс подключает к шлюзу
+# только свои шарды, иначе каждое взаимодействие обработал бы каждый процесс.
+# INSTANCE_COUNT/INSTANCE_INDEX - краткая запись: без SHARD_COUNT шардов
+# столько же, сколько процессов, без SHARD_IDS процессу достаются шарды
+# shard_id % INSTANCE_COUNT == INSTANCE_INDEX
+INSTANCE_COUNT = int(os.getenv("INSTANCE_COUNT", "1"))
+INSTANCE_INDEX = int(os.getenv("INSTANCE_INDEX", "0"))
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+if not 0 <= INSTANCE_INDEX < INSTANCE_COUNT:
+    raise ValueError(f"INSTANCE_INDEX должен быть от 0 до {INSTANCE_COUNT - 1}, получено {INSTANCE_INDEX}")
+if INSTANCE_COUNT > 1:
+    if SHARD_COUNT == "auto":
+        raise ValueError("Несколько процессов требуют фиксированного SHARD_COUNT: с \"auto\" каждый подключит все шарды")
+    SHARD_COUNT = SHARD_COUNT or str(INSTANCE_COUNT)
+    SHARD_IDS = SHARD_IDS or [
+        shard_id for shard_id in range(int(SHARD_COUNT)) if shard_id % INSTANCE_COUNT == INSTANCE_INDEX
+    ]
+if SHARD_COUNT not in ("", "auto") and not SHARD_COUNT.isdigit():
+    raise ValueError(f"SHARD_COUNT должен быть числом или \"auto\", получено {SHARD_COUNT!r}")
+if SHARD_IDS:
+    if not SHARD_COUNT:
+        raise ValueError("SHARD_IDS задаются вместе с SHARD_COUNT")
+    if SHARD_COUNT == "auto":
+        raise ValueError("SHARD_IDS требуют фиксированного SHARD_COUNT")
+    if any(not 0 <= shard_id < int(SHARD_COUNT) for shard_id in SHARD_IDS):
+        raise ValueError(f"SHARD_IDS должны быть от 0 до {int(SHARD_COUNT) - 1}: {SHARD_IDS}")
+# Остальные шарды подключают другие процессы
+MULTI_PROCESS = bool(SHARD_IDS) and len(set(SHARD_IDS)) < int(SHARD_COUNT)
+
+def create_bot():
+    options = dict(command_prefix="!", intents=intents, help_command=None)
+    if LOW_MEMORY_MODE:
+        options.update(
+            # Префиксных команд нет, а без текста сообщений префикс "!" не работает
+            command_prefix=commands.when_mentioned,
+            member_cache_flags=disnake.MemberCacheFlags.none(),
+            chunk_guilds_at_startup=False,
+            max_messages=None
+        )
+    # SHARD_COUNT и SHARD_IDS уже проверены выше
+    if not SHARD_COUNT:
+        return commands.Bot(**options)
+    if SHARD_COUNT == "auto":
+        return commands.AutoShardedBot(**options)
+    return commands.AutoShardedBot(shard_count=int(SHARD_COUNT), shard_ids=SHARD_IDS or None, **options)
+
+bot = create_bot()
+
+# Хранилище: postgres или встроенный sqlite (файл SQLITE_PATH)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", "rollback_bot.db")
+# Сколько ждать освобождения блокировки записи SQLite, секунды
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+
+# Канал PostgreSQL LISTEN/NOTIFY, по которому процессы сообщают об изменениях списков
+CHANGE_FEED_CHANNEL = "rollback_bot_changes"
+CHANGE_FEED_RECONNECT_SECONDS = float(os.getenv("CHANGE_FEED_RECONNECT_SECONDS", "5"))
 
 # PostgreSQL подключение
-def get_db_connection():
-    """Получает соединение с PostgreSQL из Railway"""
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Соединение, простоявшее в пуле дольше этого времени, проверяется перед выдачей
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", "30"))
+
+def get_db_connect_kwargs():
+    """Параметры подключения к PostgreSQL из Railway"""
     database_url = os.getenv('DATABASE_URL')
     
+    # TCP keepalive, чтобы мёртвые сокеты в пуле обнаруживались быстрее
+    keepalive_kwargs = {
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+    }
+    
     if not database_url:
         # Для локальной разработки
-        return psycopg2.connect(
+        return dict(
             dbname='rollback_bot',
             user='postgres',
             password='password',
-            host='localhost'
+            host='localhost',
+            **keepalive_kwargs
         )
     
     # Для Railway
     parsed_url = urllib.parse.urlparse(database_url)
-    conn = psycopg2.connect(
+    return dict(
         database=parsed_url.path[1:],
         user=parsed_url.username,
         password=parsed_url.password,
         host=parsed_url.hostname,
         port=parsed_url.port,
-        sslmode='require'
+        sslmode='require',
+        **keepalive_kwargs
     )
-    return conn
 
-def init_db():
-    """Инициализация базы данных PostgreSQL"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def get_db_connection():
+    """Открывает отдельное соединение с PostgreSQL в обход пула"""
+    return psycopg2.connect(**get_db_connect_kwargs())
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """Соединение, запоминающее подготовленные на нём запросы"""
     
-    # Таблица списков
-    cursor.execute('''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+class ConnectionPool:
+    """Ограниченный пул соединений с проверкой живости и переподключением"""
+    
+    def __init__(self, minconn, maxconn, **connect_kwargs):
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, **connect_kwargs)
+        # ThreadedConnectionPool бросает PoolError при исчерпании - вместо этого ждём
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self.minconn = minconn
+        self.maxconn = maxconn
+    
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        with self._lock:
+            last_used = self._last_used.get(id(conn), 0)
+        if time.monotonic() - last_used < DB_POOL_HEALTHCHECK_INTERVAL:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+    
+    def _discard(self, conn):
+        with self._lock:
+            self._last_used.pop(id(conn), None)
+        try:
+            self._pool.putconn(conn, close=True)
+        except pg_pool.PoolError:
+            pass
+    
+    def getconn(self):
+        self._slots.acquire()
+        try:
+            # Устаревшие соединения выбрасываются, пока не найдётся живое или не откроется новое
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+            raise psycopg2.OperationalError("Не удалось получить рабочее соединение из пула")
+        except Exception:
+            self._slots.release()
+            raise
+    
+    def putconn(self, conn, broken=False):
+        try:
+            if broken or conn.closed:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+    
+    def stats(self):
+        """Открытые соединения и занятые из них"""
+        in_use = len(self._pool._used)
+        return {"open": in_use + len(self._pool._pool), "in_use": in_use}
+    
+    def closeall(self):
+        self._pool.closeall()
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    """Возвращает пул соединений, создавая его при первом обращении"""
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX,
+                    connection_factory=PreparedConnection,
+                    **get_db_connect_kwargs()
+                )
+                print(f"✅ Пул соединений PostgreSQL создан ({DB_POOL_MIN}-{DB_POOL_MAX})")
+    return _db_pool
+
+def close_db_pool():
+    """Закрывает все соединения пула"""
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.closeall()
+            _db_pool = None
+
+@contextmanager
+def db_connection():
+    """Выдаёт соединение из пула; коммит при успехе, откат при ошибке"""
+    pool = get_db_pool()
+    conn = pool.getconn()
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception as e:
+        broken = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        raise
+    finally:
+        pool.putconn(conn, broken=broken)
+
+# Настройки серверов живут в таблицах guild_configs и guild_admins. Новый сервер
+# подключается без перезапуска: строки в обеих таблицах и команда /reload_config.
+# Запросы ниже переносят прежнюю конфигурацию из кода и подходят обоим хранилищам
+GUILD_CONFIG_SEED = [
+    """
+    INSERT INTO guild_configs (guild_id, static_channel_id) VALUES
+        (1429544000188317831, 1429831404379705474),
+        (1003525677640851496, 1429128623776075916)
+    ON CONFLICT DO NOTHING
+    """,
+    """
+    INSERT INTO guild_admins (guild_id, kind, target_id) VALUES
+        (1429544000188317831, 'role', 1310673963000528949),
+        (1429544000188317831, 'role', 1223589384452833290),
+        (1429544000188317831, 'role', 1429544345463296000),
+        (1003525677640851496, 'user', 1381084245321056438),
+        (1003525677640851496, 'user', 427922282959077386),
+        (1003525677640851496, 'user', 300627668460634124),
+        (1003525677640851496, 'user', 773983223595139083),
+        (1003525677640851496, 'user', 415145467702280192)
+    ON CONFLICT DO NOTHING
+    """,
+]
+
+# Миграции схемы PostgreSQL: (версия, описание, запросы). Каждая применяется
+# один раз, применённые версии хранятся в schema_migrations. Новые изменения
+# схемы - только новой миграцией в конце списка (и в SQLITE_MIGRATIONS).
+POSTGRES_MIGRATIONS = [
+    (1, "Базовые таблицы", [
+        '''
         CREATE TABLE IF NOT EXISTS lists (
             id TEXT PRIMARY KEY,
             name TEXT NOT NULL,
@@ -73,10 +314,8 @@ def init_db():
             message_id BIGINT,
             status_message_id BIGINT
         )
-    ''')
-    
-    # Таблица участников
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS participants (
             id SERIAL PRIMARY KEY,
             list_id TEXT NOT NULL REFERENCES lists(id) ON DELETE CASCADE,
@@ -86,10 +325,8 @@ def init_db():
             registered_at TIMESTAMP NOT NULL,
             UNIQUE(list_id, user_id)
         )
-    ''')
-    
-    # Таблица откатов
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS rollbacks (
             id SERIAL PRIMARY KEY,
             list_id TEXT NOT NULL REFERENCES lists(id) ON DELETE CASCADE,
@@ -98,212 +335,1830 @@ def init_db():
             text TEXT NOT NULL,
             timestamp TIMESTAMP NOT NULL
         )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    print("✅ База данных PostgreSQL инициализирована")
+        ''',
+    ]),
+    (2, "Хэши последнего отправленного содержимого сообщений", [
+        "ALTER TABLE lists ADD COLUMN IF NOT EXISTS message_hash TEXT",
+        "ALTER TABLE lists ADD COLUMN IF NOT EXISTS status_message_hash TEXT",
+    ]),
+    (3, "Блоки статуса", [
+        '''
+        CREATE TABLE IF NOT EXISTS status_chunks (
+            list_id TEXT NOT NULL REFERENCES lists(id) ON DELETE CASCADE,
+            chunk_index INTEGER NOT NULL,
+            message_id BIGINT NOT NULL,
+            content_hash TEXT,
+            PRIMARY KEY (list_id, chunk_index)
+        )
+        ''',
+    ]),
+    (4, "Индексы для горячих запросов", [
+        # /list_all: списки сервера по дате создания
+        "CREATE INDEX IF NOT EXISTS lists_guild_created_idx ON lists (guild_id, created_at DESC, id)",
+        # Счётчики откатов в /list_all
+        "CREATE INDEX IF NOT EXISTS participants_list_rollback_idx ON participants (list_id, has_rollback)",
+        # Откаты списка и удаление отката пользователя
+        "CREATE INDEX IF NOT EXISTS rollbacks_list_user_idx ON rollbacks (list_id, user_id)",
+    ]),
+    (5, "Не больше одного отката на участника", [
+        # Оставляем только последний откат пользователя - именно он и показывался в статусе
+        '''
+        DELETE FROM rollbacks r
+        USING rollbacks newer
+        WHERE newer.list_id = r.list_id AND newer.user_id = r.user_id
+          AND (newer.timestamp, newer.id) > (r.timestamp, r.id)
+        ''',
+        "DROP INDEX IF EXISTS rollbacks_list_user_idx",
+        "CREATE UNIQUE INDEX IF NOT EXISTS rollbacks_list_user_key ON rollbacks (list_id, user_id)",
+        # Флаг has_rollback мог разойтись с таблицей откатов из-за гонок
+        '''
+        UPDATE participants p
+        SET has_rollback = EXISTS (
+            SELECT 1 FROM rollbacks r WHERE r.list_id = p.list_id AND r.user_id = p.user_id
+        )
+        ''',
+    ]),
+    (6, "Настройки серверов в базе", [
+        '''
+        CREATE TABLE IF NOT EXISTS guild_configs (
+            guild_id BIGINT PRIMARY KEY,
+            static_channel_id BIGINT NOT NULL
+        )
+        ''',
+        # kind: role - роль администраторов, user - отдельный пользователь
+        '''
+        CREATE TABLE IF NOT EXISTS guild_admins (
+            guild_id BIGINT NOT NULL REFERENCES guild_configs(guild_id) ON DELETE CASCADE,
+            kind TEXT NOT NULL CHECK (kind IN ('role', 'user')),
+            target_id BIGINT NOT NULL,
+            PRIMARY KEY (guild_id, kind, target_id)
+        )
+        ''',
+        *GUILD_CONFIG_SEED,
+    ]),
+    # Столбец вычисляется при каждой записи отката, GIN-индекс ищет по лексемам
+    # без просмотра таблицы. Добавление STORED-столбца перезаписывает таблицу
+    (7, "Полнотекстовый поиск по откатам", [
+        '''
+        ALTER TABLE rollbacks ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('russian'::regconfig, text)) STORED
+        ''',
+        "CREATE INDEX IF NOT EXISTS rollbacks_search_idx ON rollbacks USING GIN (search_vector)",
+    ]),
+    (8, "Постоянные места участников в блоках статуса", [
+        "ALTER TABLE participants ADD COLUMN IF NOT EXISTS chunk_index INTEGER",
+        # Существующие участники раскладываются так, как отрисовывались раньше: по 8 в блоке
+        '''
+        UPDATE participants p SET chunk_index = numbered.position / 8 + 1
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY list_id ORDER BY registered_at, id) - 1 AS position
+            FROM participants
+        ) numbered
+        WHERE numbered.id = p.id AND p.chunk_index IS NULL
+        ''',
+        "ALTER TABLE participants ALTER COLUMN chunk_index SET NOT NULL",
+        "CREATE INDEX IF NOT EXISTS participants_list_chunk_idx ON participants (list_id, chunk_index)",
+    ]),
+    # Нажатия старых кнопок со случайными custom_id находят список по сообщению
+    (9, "Поиск списка по сообщению", [
+        "CREATE INDEX IF NOT EXISTS lists_message_idx ON lists (message_id)",
+    ]),
+]
 
-# Функции для работы с базой данных
-def create_new_list(list_id, list_name, channel_id, created_by, guild_id):
-    """Создает новый список в базе данных"""
-    config = get_server_config(guild_id)
-    static_channel_id = config["static_channel_id"] if config else channel_id
+# Ключ advisory-блокировки: несколько процессов не применяют миграции одновременно
+MIGRATIONS_LOCK_KEY = 7241001
+
+# Участников в одном сообщении-блоке статуса: строка участника с превью отката
+# занимает не больше ~210 символов, так что блок укладывается в лимит Discord
+STATUS_CHUNK_SIZE = 8
+
+def assign_chunk_slots(chunk_sizes, count):
+    """Выдаёт места в блоках статуса для count новых участников.
+    
+    chunk_sizes - занятость блоков {chunk_index: участников}, обновляется на месте.
+    Сначала заполняются освободившиеся места в младших блоках, затем новые блоки.
+    """
+    slots = []
+    chunk_index = 1
+    while len(slots) < count:
+        taken = min(STATUS_CHUNK_SIZE - chunk_sizes.get(chunk_index, 0), count - len(slots))
+        if taken > 0:
+            slots.extend([chunk_index] * taken)
+            chunk_sizes[chunk_index] = chunk_sizes.get(chunk_index, 0) + taken
+        chunk_index += 1
+    return slots
+
+# Состояние списка в памяти
+@dataclass(slots=True)
+class Participant:
+    user_id: str
+    display_name: str
+    has_rollback: bool
+    registered_at: datetime
+    # Блок статуса, за которым закреплён участник (с 1)
+    chunk_index: int
+
+@dataclass(slots=True)
+class Rollback:
+    user_id: str
+    user_name: str
+    text: str
+    timestamp: datetime
+
+@dataclass(slots=True)
+class StatusChunk:
+    message_id: int
+    content_hash: Optional[str]
+
+@dataclass(slots=True)
+class ListState:
+    id: str
+    name: str
+    channel_id: int
+    static_channel_id: int
+    created_by: str
+    guild_id: int
+    created_at: datetime
+    message_id: Optional[int] = None
+    status_message_id: Optional[int] = None
+    # Хэши последнего отправленного содержимого, чтобы не слать одинаковые правки
+    message_hash: Optional[str] = None
+    status_message_hash: Optional[str] = None
+    # user_id -> Participant в порядке регистрации
+    participants: dict = field(default_factory=dict)
+    # Откаты в порядке отправки
+    rollbacks: list = field(default_factory=list)
+    # Номер блока статуса (с 1) -> StatusChunk
+    status_chunks: dict = field(default_factory=dict)
+
+    def rollbacks_by_user(self):
+        """Индекс user_id -> последний откат пользователя"""
+        return {rollback.user_id: rollback for rollback in self.rollbacks}
+
+@dataclass(slots=True)
+class ListSummary:
+    id: str
+    name: str
+    participants_count: int
+    rollbacks_count: int
+
+# Настройки сервера: множества готовы для проверки прав без перебора списков
+@dataclass(frozen=True, slots=True)
+class GuildConfig:
+    guild_id: int
+    static_channel_id: int
+    admin_role_ids: frozenset = frozenset()
+    admin_user_ids: frozenset = frozenset()
+
+# Найденный откат: snippet - фрагмент текста с найденными словами, выделенными **
+@dataclass(slots=True)
+class RollbackMatch:
+    list_id: str
+    list_name: str
+    user_name: str
+    snippet: str
+    timestamp: datetime
+
+# Сколько списков показывается на одной странице /list_all
+LISTS_PAGE_SIZE = 10
+# Сколько откатов показывается на одной странице /search_rollbacks
+SEARCH_PAGE_SIZE = 5
+
+# Подготовленные запросы: готовятся на соединении при первом использовании
+# и затем выполняются через EXECUTE без повторного разбора и планирования
+PREPARED_STATEMENTS = {
+    "list_id_exists": "SELECT 1 FROM lists WHERE id = $1",
+    "select_list_by_message": "SELECT id FROM lists WHERE message_id = $1 AND guild_id = $2",
+    "insert_list": """
+        INSERT INTO lists (id, name, channel_id, static_channel_id, created_by, guild_id, created_at)
+        VALUES ($1, $2, $3, $4, $5, $6, $7)
+    """,
+    # Полное состояние списка одной строкой: участники и откаты агрегируются в JSON на сервере
+    "select_list_state": """
+        SELECT l.id, l.name, l.channel_id, l.static_channel_id, l.created_by, l.guild_id,
+               l.created_at, l.message_id, l.status_message_id, l.message_hash, l.status_message_hash,
+               (SELECT COALESCE(json_agg(json_build_array(p.user_id, p.display_name, p.has_rollback, p.registered_at, p.chunk_index)
+                                         ORDER BY p.registered_at, p.id), '[]'::json)
+                FROM participants p WHERE p.list_id = l.id),
+               (SELECT COALESCE(json_agg(json_build_array(r.user_id, r.user_name, r.text, r.timestamp)
+                                         ORDER BY r.timestamp, r.id), '[]'::json)
+                FROM rollbacks r WHERE r.list_id = l.id),
+               (SELECT COALESCE(json_agg(json_build_array(c.chunk_index, c.message_id, c.content_hash)
+                                         ORDER BY c.chunk_index), '[]'::json)
+                FROM status_chunks c WHERE c.list_id = l.id)
+        FROM lists l
+        WHERE l.id = $1 AND l.guild_id = $2
+    """,
+    # Каждое сообщение пишет только свою пару столбцов: отрисовки двух сообщений
+    # могут держать разные копии ListState и не должны затирать друг друга
+    "update_participants_message": "UPDATE lists SET message_id = $1, message_hash = $2 WHERE id = $3",
+    "update_status_message": "UPDATE lists SET status_message_id = $1, status_message_hash = $2 WHERE id = $3",
+    # Регистрации в списке идут по очереди: места в блоках считаются по текущей
+    # занятости. NO KEY UPDATE не мешает вставкам откатов, ссылающимся на список
+    "lock_list_for_registration": "SELECT 1 FROM lists WHERE id = $1 FOR NO KEY UPDATE",
+    "select_chunk_sizes": "SELECT chunk_index, COUNT(*) FROM participants WHERE list_id = $1 GROUP BY chunk_index",
+    "select_registered_user_ids": "SELECT user_id FROM participants WHERE list_id = $1 AND user_id = ANY($2)",
+    # Мутации участника - одним запросом: части CTE выполняются в одном снимке и транзакции
+    "delete_participant": """
+        WITH removed_rollbacks AS (
+            DELETE FROM rollbacks WHERE list_id = $1 AND user_id = $2
+        )
+        DELETE FROM participants WHERE list_id = $1 AND user_id = $2
+        RETURNING user_id
+    """,
+    # Откат сохраняется только для зарегистрированного участника и заменяет предыдущий
+    "upsert_rollback": """
+        WITH participant AS (
+            UPDATE participants SET has_rollback = TRUE
+            WHERE list_id = $1 AND user_id = $2
+            RETURNING user_id
+        )
+        INSERT INTO rollbacks (list_id, user_id, user_name, text, timestamp)
+        SELECT $1, user_id, $3, $4, $5 FROM participant
+        ON CONFLICT (list_id, user_id)
+        DO UPDATE SET user_name = EXCLUDED.user_name, text = EXCLUDED.text, timestamp = EXCLUDED.timestamp
+        RETURNING user_id, user_name, text, timestamp
+    """,
+    "delete_rollback": """
+        WITH removed AS (
+            DELETE FROM rollbacks WHERE list_id = $1 AND user_id = $2
+            RETURNING user_id
+        ),
+        participant AS (
+            UPDATE participants SET has_rollback = FALSE
+            WHERE list_id = $1 AND user_id = $2
+        )
+        SELECT COUNT(*) FROM removed
+    """,
+    # Страница списков сервера со счётчиками: сначала страница по lists_guild_created_idx,
+    # затем участники считаются только для её списков
+    "select_guild_lists_page": """
+        SELECT l.id, l.name, c.participants_count, c.rollbacks_count
+        FROM (
+            SELECT id, name, created_at FROM lists
+            WHERE guild_id = $1
+            ORDER BY created_at DESC, id
+            LIMIT $2 OFFSET $3
+        ) l
+        LEFT JOIN LATERAL (
+            SELECT COUNT(*) AS participants_count,
+                   COUNT(*) FILTER (WHERE p.has_rollback) AS rollbacks_count
+            FROM participants p WHERE p.list_id = l.id
+        ) c ON TRUE
+        ORDER BY l.created_at DESC, l.id
+    """,
+    "count_guild_lists": "SELECT COUNT(*) FROM lists WHERE guild_id = $1",
+    "count_lists": "SELECT COUNT(*) FROM lists",
+    "select_guild_list_names": "SELECT id, name, created_at FROM lists WHERE guild_id = $1",
+    "delete_list": "DELETE FROM lists WHERE id = $1",
+    "delete_list_rollbacks": "DELETE FROM rollbacks WHERE list_id = $1",
+    "reset_has_rollback": "UPDATE participants SET has_rollback = FALSE WHERE list_id = $1",
+    "upsert_status_chunk": """
+        INSERT INTO status_chunks (list_id, chunk_index, message_id, content_hash)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (list_id, chunk_index)
+        DO UPDATE SET message_id = EXCLUDED.message_id, content_hash = EXCLUDED.content_hash
+    """,
+    "delete_status_chunk": "DELETE FROM status_chunks WHERE list_id = $1 AND chunk_index = $2",
+    "select_guild_configs": """
+        SELECT c.guild_id, c.static_channel_id,
+               COALESCE(array_agg(a.target_id) FILTER (WHERE a.kind = 'role'), '{}'),
+               COALESCE(array_agg(a.target_id) FILTER (WHERE a.kind = 'user'), '{}')
+        FROM guild_configs c
+        LEFT JOIN guild_admins a ON a.guild_id = c.guild_id
+        GROUP BY c.guild_id
+    """,
+    # Ранжирование по всем совпадениям, фрагменты текста - только для строк страницы
+    "search_rollbacks": """
+        SELECT m.list_id, m.name, m.user_name,
+               ts_headline('russian', m.text, m.query, 'StartSel=**, StopSel=**, MaxWords=30, MinWords=10'),
+               m.timestamp
+        FROM (
+            SELECT r.id, r.list_id, l.name, r.user_name, r.text, r.timestamp, q.query,
+                   ts_rank(r.search_vector, q.query) AS rank
+            FROM websearch_to_tsquery('russian', $2) AS q(query)
+            JOIN rollbacks r ON r.search_vector @@ q.query
+            JOIN lists l ON l.id = r.list_id
+            WHERE l.guild_id = $1 AND ($3::timestamp IS NULL OR r.timestamp >= $3::timestamp)
+            ORDER BY rank DESC, r.timestamp DESC, r.id
+            LIMIT $4 OFFSET $5
+        ) m
+        ORDER BY m.rank DESC, m.timestamp DESC, m.id
+    """,
+    # Уведомление доставляется подписчикам только после коммита транзакции
+    "notify_config_change": "SELECT pg_notify($1, json_build_object('origin', $2::text, 'kind', 'config')::text)",
+    "notify_list_change": """
+        SELECT pg_notify($1, json_build_object(
+            'origin', $2::text, 'kind', $3::text, 'list_id', l.id, 'guild_id', l.guild_id
+        )::text)
+        FROM lists l WHERE l.id = $4
+    """,
+}
+
+def execute_prepared(cursor, name, params=()):
+    """Выполняет запрос из PREPARED_STATEMENTS, подготавливая его на соединении при необходимости"""
+    conn = cursor.connection
+    if name not in conn.prepared:
+        cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        conn.prepared.add(name)
+    if params:
+        placeholders = ", ".join(["%s"] * len(params))
+        cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+# Хранилище: интерфейс и реализации для PostgreSQL и встроенного SQLite.
+# Методы синхронные и вызываются в пуле потоков через run_db
+class Storage(ABC):
+    """Интерфейс хранилища списков"""
+    
+    name = None
+    # Сообщает ли хранилище другим процессам об изменениях (см. ChangeFeed)
+    supports_change_feed = False
+    
+    @abstractmethod
+    def init(self):
+        """Применяет недостающие миграции схемы"""
+    
+    @abstractmethod
+    def open_change_listener(self):
+        """Открывает подписку на изменения списков или возвращает None, если её нет"""
+    
+    @abstractmethod
+    def close(self):
+        """Закрывает все соединения"""
+    
+    @abstractmethod
+    def connection_stats(self):
+        """Открытые соединения и занятые из них"""
+    
+    @abstractmethod
+    def list_id_exists(self, list_id):
+        """Проверяет, занят ли ID списка"""
+    
+    @abstractmethod
+    def find_list_by_message(self, guild_id, message_id):
+        """ID списка, чьё сообщение с участниками имеет этот ID, или None"""
+    
+    @abstractmethod
+    def create_new_list(self, list_id, list_name, channel_id, static_channel_id, created_by, guild_id):
+        """Создает новый список; возвращает его состояние"""
+    
+    @abstractmethod
+    def get_list(self, list_id, guild_id):
+        """Получает список вместе с участниками, откатами и блоками статуса или None"""
+    
+    @abstractmethod
+    def save_participants_message(self, list_id, message_id, message_hash):
+        """Сохраняет ID и хэш сообщения со списком участников"""
+    
+    @abstractmethod
+    def save_status_message(self, list_id, message_id, message_hash):
+        """Сохраняет ID и хэш заголовка статуса"""
+    
+    @abstractmethod
+    def register_participant(self, list_id, user_id, display_name):
+        """Регистрирует участника в списке; возвращает участника или None, если он уже есть"""
+    
+    @abstractmethod
+    def register_participants(self, list_id, members):
+        """Регистрирует пачку участников; возвращает только новых.
+        
+        members - список пар (user_id, display_name). Уже зарегистрированные
+        пропускаются и не попадают в результат. Если списка уже нет - None.
+        """
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    @abstractmethod
+    def save_status_chunk(self, list_id, chunk_index, chunk):
+        """Сохраняет сообщение блока статуса"""
     
-    cursor.execute('''
-        INSERT INTO lists (id, name, channel_id, static_channel_id, created_by, guild_id, created_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    ''', (list_id, list_name, channel_id, static_channel_id, created_by, guild_id, datetime.now()))
+    @abstractmethod
+    def delete_status_chunk(self, list_id, chunk_index):
+        """Удаляет запись о лишнем блоке статуса"""
     
-    conn.commit()
-    conn.close()
+    @abstractmethod
+    def remove_participant(self, list_id, user_id):
+        """Удаляет участника вместе с его откатом; возвращает False, если участника уже нет"""
     
-    return {
-        "id": list_id,
-        "name": list_name,
-        "channel_id": channel_id,
-        "static_channel_id": static_channel_id,
-        "created_by": created_by,
-        "guild_id": guild_id,
-        "created_at": datetime.now().isoformat(),
-        "participants": {},
-        "rollbacks": {},
-        "message_id": None,
-        "status_message_id": None
-    }
-
-def get_list(list_id, guild_id):
-    """Получает список из базы данных"""
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    @abstractmethod
+    def replace_rollback(self, list_id, user_id, user_name, text):
+        """Сохраняет откат участника, заменяя предыдущий.
+        
+        Возвращает сохранённый откат или None, если участник не зарегистрирован.
+        """
     
-    cursor.execute("SELECT * FROM lists WHERE id = %s AND guild_id = %s", (list_id, guild_id))
-    list_row = cursor.fetchone()
+    @abstractmethod
+    def remove_user_rollback(self, list_id, user_id):
+        """Удаляет откат пользователя; возвращает False, если удалять было нечего"""
     
-    if not list_row:
-        conn.close()
-        return None
+    @abstractmethod
+    def get_all_lists(self, guild_id, page=0, page_size=LISTS_PAGE_SIZE):
+        """Получает страницу списков сервера со счётчиками и общее число списков"""
     
-    list_data = dict(list_row)
-    # Конвертируем datetime в строку
-    list_data["created_at"] = list_data["created_at"].isoformat()
-    
-    # Получаем участников
-    cursor.execute("SELECT * FROM participants WHERE list_id = %s", (list_id,))
-    participants = {}
-    for row in cursor.fetchall():
-        row_dict = dict(row)
-        participants[row_dict["user_id"]] = {
-            "display_name": row_dict["display_name"],
-            "has_rollback": row_dict["has_rollback"],
-            "registered_at": row_dict["registered_at"].isoformat()
-        }
+    @abstractmethod
+    def count_lists(self):
+        """Общее число списков в базе"""
     
-    # Получаем откаты
-    cursor.execute("SELECT * FROM rollbacks WHERE list_id = %s", (list_id,))
-    rollbacks = {}
-    for row in cursor.fetchall():
-        row_dict = dict(row)
-        rollbacks[row_dict["timestamp"].isoformat()] = {
-            "user_id": row_dict["user_id"],
-            "user_name": row_dict["user_name"],
-            "text": row_dict["text"],
-            "timestamp": row_dict["timestamp"].isoformat()
-        }
+    @abstractmethod
+    def get_guild_list_names(self, guild_id):
+        """Получает ID, названия и даты создания всех списков сервера"""
     
-    conn.close()
+    @abstractmethod
+    def delete_list_from_db(self, list_id):
+        """Удаляет список вместе с участниками и откатами"""
     
-    list_data["participants"] = participants
-    list_data["rollbacks"] = rollbacks
+    @abstractmethod
+    def reset_list_rollbacks(self, list_id):
+        """Сбрасывает все откаты в списке"""
     
-    return list_data
-
-def update_list_data(list_data):
-    """Обновляет данные списка в базе данных"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    @abstractmethod
+    def search_rollbacks(self, guild_id, query, since=None, page=0, page_size=SEARCH_PAGE_SIZE):
+        """Ищет откаты сервера по словам запроса, самые релевантные первыми.
+        
+        since - не раньше этого момента (None - за всё время). Возвращает
+        страницу RollbackMatch и признак наличия следующей страницы.
+        """
     
-    cursor.execute('''
-        UPDATE lists SET 
-        message_id = %s, status_message_id = %s
-        WHERE id = %s
-    ''', (list_data.get("message_id"), list_data.get("status_message_id"), list_data["id"]))
+    @abstractmethod
+    def get_guild_configs(self):
+        """Получает настройки всех серверов списком GuildConfig"""
     
-    conn.commit()
-    conn.close()
+    @abstractmethod
+    def publish_config_change(self):
+        """Просит другие процессы перечитать настройки серверов"""
 
-def register_participant(list_id, user_id, display_name):
-    """Регистрирует участника в списке"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute('''
-            INSERT INTO participants (list_id, user_id, display_name, has_rollback, registered_at)
-            VALUES (%s, %s, %s, %s, %s)
-        ''', (list_id, user_id, display_name, False, datetime.now()))
-        conn.commit()
-        return True
-    except psycopg2.IntegrityError:
-        return False
-    finally:
-        conn.close()
+class PostgresChangeListener:
+    """Отдельное соединение вне пула, подписанное на CHANGE_FEED_CHANNEL"""
+    
+    def __init__(self):
+        self.conn = get_db_connection()
+        self.conn.set_session(autocommit=True)
+        self.conn.cursor().execute(f"LISTEN {CHANGE_FEED_CHANNEL}")
+    
+    def fileno(self):
+        return self.conn.fileno()
+    
+    def drain(self):
+        """Читает пришедшие уведомления без блокировки; возвращает их тексты"""
+        self.conn.poll()
+        payloads = [notify.payload for notify in self.conn.notifies]
+        del self.conn.notifies[:]
+        return payloads
+    
+    def close(self):
+        self.conn.close()
 
-def remove_participant(list_id, user_id):
-    """Удаляет участника из списка"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+class PostgresStorage(Storage):
+    """Хранилище в PostgreSQL: пул соединений и подготовленные запросы.
     
-    cursor.execute("DELETE FROM participants WHERE list_id = %s AND user_id = %s", (list_id, user_id))
-    cursor.execute("DELETE FROM rollbacks WHERE list_id = %s AND user_id = %s", (list_id, user_id))
+    Мутации в той же транзакции публикуют уведомление об изменённом списке
+    (см. ChangeFeed), поэтому другие процессы узнают только о закоммиченных
+    изменениях.
+    """
     
-    conn.commit()
-    conn.close()
-
-def add_rollback(list_id, user_id, user_name, text):
-    """Добавляет откат в базу данных"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    name = "postgres"
+    supports_change_feed = True
     
-    timestamp = datetime.now()
+    def _publish(self, cursor, list_id, kind):
+        execute_prepared(cursor, "notify_list_change", (CHANGE_FEED_CHANNEL, INSTANCE_ID, kind, list_id))
     
-    cursor.execute('''
-        INSERT INTO rollbacks (list_id, user_id, user_name, text, timestamp)
-        VALUES (%s, %s, %s, %s, %s)
-    ''', (list_id, user_id, user_name, text, timestamp))
+    def init(self):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK_KEY,))
+            
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL
+                )
+            ''')
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+            
+            for version, description, statements in POSTGRES_MIGRATIONS:
+                if version in applied:
+                    continue
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+                    (version, description, datetime.now())
+                )
+                print(f"🔧 Применена миграция {version}: {description}")
+        
+        print("✅ База данных PostgreSQL инициализирована")
+    
+    def close(self):
+        close_db_pool()
+    
+    def open_change_listener(self):
+        return PostgresChangeListener()
+    
+    def connection_stats(self):
+        if _db_pool is None:
+            return {"open": 0, "in_use": 0}
+        return _db_pool.stats()
+    
+    def list_id_exists(self, list_id):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "list_id_exists", (list_id,))
+            return cursor.fetchone() is not None
+    
+    def find_list_by_message(self, guild_id, message_id):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "select_list_by_message", (message_id, guild_id))
+            row = cursor.fetchone()
+        return row[0] if row else None
+    
+    def create_new_list(self, list_id, list_name, channel_id, static_channel_id, created_by, guild_id):
+        created_at = datetime.now()
+        
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "insert_list", (
+                list_id, list_name, channel_id, static_channel_id, created_by, guild_id, created_at
+            ))
+            self._publish(cursor, list_id, "created")
+        
+        return ListState(
+            id=list_id,
+            name=list_name,
+            channel_id=channel_id,
+            static_channel_id=static_channel_id,
+            created_by=created_by,
+            guild_id=guild_id,
+            created_at=created_at
+        )
     
-    cursor.execute('''
-        UPDATE participants SET has_rollback = TRUE 
-        WHERE list_id = %s AND user_id = %s
-    ''', (list_id, user_id))
+    def get_list(self, list_id, guild_id):
+        # Всё состояние списка - одним запросом
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "select_list_state", (list_id, guild_id))
+            row = cursor.fetchone()
+        
+        if not row:
+            return None
+        
+        (list_id, name, channel_id, static_channel_id, created_by, guild_id, created_at,
+         message_id, status_message_id, message_hash, status_message_hash,
+         participant_rows, rollback_rows, chunk_rows) = row
+        
+        # Участники и откаты приходят уже отсортированными массивами JSON
+        participants = {}
+        for user_id, display_name, has_rollback, registered_at, chunk_index in participant_rows:
+            participants[user_id] = Participant(
+                user_id, display_name, has_rollback, datetime.fromisoformat(registered_at), chunk_index
+            )
+        
+        rollbacks = [
+            Rollback(user_id, user_name, text, datetime.fromisoformat(timestamp))
+            for user_id, user_name, text, timestamp in rollback_rows
+        ]
+        
+        status_chunks = {
+            chunk_index: StatusChunk(message_id, content_hash)
+            for chunk_index, message_id, content_hash in chunk_rows
+        }
+        
+        return ListState(
+            id=list_id,
+            name=name,
+            channel_id=channel_id,
+            static_channel_id=static_channel_id,
+            created_by=created_by,
+            guild_id=guild_id,
+            created_at=created_at,
+            message_id=message_id,
+            status_message_id=status_message_id,
+            message_hash=message_hash,
+            status_message_hash=status_message_hash,
+            participants=participants,
+            rollbacks=rollbacks,
+            status_chunks=status_chunks
+        )
     
-    conn.commit()
-    conn.close()
+    def save_participants_message(self, list_id, message_id, message_hash):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "update_participants_message", (message_id, message_hash, list_id))
+            self._publish(cursor, list_id, "messages")
+    
+    def save_status_message(self, list_id, message_id, message_hash):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "update_status_message", (message_id, message_hash, list_id))
+            self._publish(cursor, list_id, "messages")
+    
+    def register_participant(self, list_id, user_id, display_name):
+        registered = self.register_participants(list_id, [(user_id, display_name)])
+        return registered[0] if registered else None
+    
+    def register_participants(self, list_id, members):
+        registered_at = datetime.now()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "lock_list_for_registration", (list_id,))
+            if cursor.fetchone() is None:
+                # Список удалён
+                return None
+            
+            execute_prepared(cursor, "select_registered_user_ids", (list_id, [user_id for user_id, _ in members]))
+            registered = {row[0] for row in cursor.fetchall()}
+            new_members = [(user_id, name) for user_id, name in dict(members).items() if user_id not in registered]
+            if not new_members:
+                return []
+            
+            execute_prepared(cursor, "select_chunk_sizes", (list_id,))
+            slots = assign_chunk_slots(dict(cursor.fetchall()), len(new_members))
+            participants = [
+                Participant(user_id, display_name, False, registered_at, chunk_index)
+                for (user_id, display_name), chunk_index in zip(new_members, slots)
+            ]
+            # Одним запросом на всю пачку
+            execute_values(cursor, """
+                INSERT INTO participants (list_id, user_id, display_name, has_rollback, registered_at, chunk_index)
+                VALUES %s
+            """, [(list_id, p.user_id, p.display_name, False, registered_at, p.chunk_index) for p in participants])
+            self._publish(cursor, list_id, "data")
+        return participants
+    
+    def save_status_chunk(self, list_id, chunk_index, chunk):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "upsert_status_chunk", (list_id, chunk_index, chunk.message_id, chunk.content_hash))
+            self._publish(cursor, list_id, "messages")
+    
+    def delete_status_chunk(self, list_id, chunk_index):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "delete_status_chunk", (list_id, chunk_index))
+            self._publish(cursor, list_id, "messages")
+    
+    def remove_participant(self, list_id, user_id):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "delete_participant", (list_id, user_id))
+            removed = cursor.fetchone() is not None
+            if removed:
+                self._publish(cursor, list_id, "data")
+            return removed
+    
+    def replace_rollback(self, list_id, user_id, user_name, text):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "upsert_rollback", (list_id, user_id, user_name, text, datetime.now()))
+            row = cursor.fetchone()
+            if row:
+                self._publish(cursor, list_id, "data")
+        
+        return Rollback(*row) if row else None
+    
+    def remove_user_rollback(self, list_id, user_id):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "delete_rollback", (list_id, user_id))
+            removed = cursor.fetchone()[0] > 0
+            if removed:
+                self._publish(cursor, list_id, "data")
+            return removed
+    
+    def get_all_lists(self, guild_id, page=0, page_size=LISTS_PAGE_SIZE):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "select_guild_lists_page", (guild_id, page_size, page * page_size))
+            rows = cursor.fetchall()
+            execute_prepared(cursor, "count_guild_lists", (guild_id,))
+            total = cursor.fetchone()[0]
+        
+        return [ListSummary(*row) for row in rows], total
+    
+    def count_lists(self):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "count_lists")
+            return cursor.fetchone()[0]
+    
+    def get_guild_list_names(self, guild_id):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "select_guild_list_names", (guild_id,))
+            return cursor.fetchall()
+    
+    def delete_list_from_db(self, list_id):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # После удаления сервер списка уже не узнать - уведомление готовится заранее
+            self._publish(cursor, list_id, "deleted")
+            execute_prepared(cursor, "delete_list", (list_id,))
+    
+    def reset_list_rollbacks(self, list_id):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "delete_list_rollbacks", (list_id,))
+            execute_prepared(cursor, "reset_has_rollback", (list_id,))
+            self._publish(cursor, list_id, "data")
+    
+    def search_rollbacks(self, guild_id, query, since=None, page=0, page_size=SEARCH_PAGE_SIZE):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # Лишняя строка показывает, есть ли следующая страница, без подсчёта всех совпадений
+            execute_prepared(cursor, "search_rollbacks", (guild_id, query, since, page_size + 1, page * page_size))
+            rows = cursor.fetchall()
+        
+        return [RollbackMatch(*row) for row in rows[:page_size]], len(rows) > page_size
     
-    return timestamp.isoformat()
+    def get_guild_configs(self):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "select_guild_configs")
+            rows = cursor.fetchall()
+        
+        return [
+            GuildConfig(guild_id, static_channel_id, frozenset(admin_role_ids), frozenset(admin_user_ids))
+            for guild_id, static_channel_id, admin_role_ids, admin_user_ids in rows
+        ]
+    
+    def publish_config_change(self):
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            execute_prepared(cursor, "notify_config_change", (CHANGE_FEED_CHANNEL, INSTANCE_ID))
+
+# Схема встроенного SQLite: даты хранятся строками ISO 8601, флаги - 0/1
+SQLITE_MIGRATIONS = [
+    (1, "Базовые таблицы", [
+        '''
+        CREATE TABLE IF NOT EXISTS lists (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            channel_id INTEGER NOT NULL,
+            static_channel_id INTEGER NOT NULL,
+            created_by TEXT NOT NULL,
+            guild_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            message_id INTEGER,
+            status_message_id INTEGER,
+            message_hash TEXT,
+            status_message_hash TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS participants (
+            id INTEGER PRIMARY KEY,
+            list_id TEXT NOT NULL REFERENCES lists(id) ON DELETE CASCADE,
+            user_id TEXT NOT NULL,
+            display_name TEXT NOT NULL,
+            has_rollback INTEGER NOT NULL DEFAULT 0,
+            registered_at TEXT NOT NULL,
+            UNIQUE(list_id, user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS rollbacks (
+            id INTEGER PRIMARY KEY,
+            list_id TEXT NOT NULL REFERENCES lists(id) ON DELETE CASCADE,
+            user_id TEXT NOT NULL,
+            user_name TEXT NOT NULL,
+            text TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            UNIQUE(list_id, user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS status_chunks (
+            list_id TEXT NOT NULL REFERENCES lists(id) ON DELETE CASCADE,
+            chunk_index INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            content_hash TEXT,
+            PRIMARY KEY (list_id, chunk_index)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS lists_guild_created_idx ON lists (guild_id, created_at DESC, id)",
+        "CREATE INDEX IF NOT EXISTS participants_list_rollback_idx ON participants (list_id, has_rollback)",
+    ]),
+    (2, "Настройки серверов в базе", [
+        '''
+        CREATE TABLE IF NOT EXISTS guild_configs (
+            guild_id INTEGER PRIMARY KEY,
+            static_channel_id INTEGER NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS guild_admins (
+            guild_id INTEGER NOT NULL REFERENCES guild_configs(guild_id) ON DELETE CASCADE,
+            kind TEXT NOT NULL CHECK (kind IN ('role', 'user')),
+            target_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, kind, target_id)
+        )
+        ''',
+        *GUILD_CONFIG_SEED,
+    ]),
+    # Внешний индекс FTS5 над rollbacks.text, синхронизируется триггерами
+    (3, "Полнотекстовый поиск по откатам", [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS rollbacks_fts USING fts5(
+            text, content='rollbacks', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollbacks_fts_insert AFTER INSERT ON rollbacks BEGIN
+            INSERT INTO rollbacks_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollbacks_fts_delete AFTER DELETE ON rollbacks BEGIN
+            INSERT INTO rollbacks_fts (rollbacks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS rollbacks_fts_update AFTER UPDATE OF text ON rollbacks BEGIN
+            INSERT INTO rollbacks_fts (rollbacks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO rollbacks_fts (rowid, text) VALUES (new.id, new.text);
+        END
+        ''',
+        "INSERT INTO rollbacks_fts (rollbacks_fts) VALUES ('rebuild')",
+    ]),
+    (4, "Постоянные места участников в блоках статуса", [
+        "ALTER TABLE participants ADD COLUMN chunk_index INTEGER NOT NULL DEFAULT 1",
+        '''
+        UPDATE participants SET chunk_index = numbered.position / 8 + 1
+        FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY list_id ORDER BY registered_at, id) - 1 AS position
+            FROM participants
+        ) AS numbered
+        WHERE numbered.id = participants.id
+        ''',
+        "CREATE INDEX IF NOT EXISTS participants_list_chunk_idx ON participants (list_id, chunk_index)",
+    ]),
+    (5, "Поиск списка по сообщению", [
+        "CREATE INDEX IF NOT EXISTS lists_message_idx ON lists (message_id)",
+    ]),
+]
 
-def remove_user_rollback(list_id, user_id):
-    """Удаляет откат пользователя"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def _sqlite_timestamp(value):
+    return value.isoformat(timespec="microseconds")
+
+class SQLiteStorage(Storage):
+    """Встроенное хранилище в файле SQLite в режиме WAL.
+    
+    Подходит для небольших серверов и локальной разработки: запросы идут без
+    сети. У каждого потока пула своё соединение; WAL позволяет читать
+    параллельно с записью, а запись начинается с BEGIN IMMEDIATE, чтобы
+    транзакции не упирались в повышение блокировки.
+    """
+    
+    name = "sqlite"
+    
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._in_use = 0
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Транзакции открываются явно в _transaction
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+    
+    @contextmanager
+    def _transaction(self, write=False):
+        """Транзакция на соединении потока; коммит при успехе, откат при ошибке"""
+        conn = self._connect()
+        with self._lock:
+            self._in_use += 1
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            with self._lock:
+                self._in_use -= 1
+    
+    def open_change_listener(self):
+        # Файл SQLite принадлежит одному процессу - подписываться не на что
+        return None
     
-    cursor.execute("DELETE FROM rollbacks WHERE list_id = %s AND user_id = %s", (list_id, user_id))
-    cursor.execute('''
-        UPDATE participants SET has_rollback = FALSE 
-        WHERE list_id = %s AND user_id = %s
-    ''', (list_id, user_id))
+    def init(self):
+        with self._transaction(write=True) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TEXT NOT NULL
+                )
+            ''')
+            applied = {row[0] for row in conn.execute("SELECT version FROM schema_migrations")}
+            
+            for version, description, statements in SQLITE_MIGRATIONS:
+                if version in applied:
+                    continue
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, _sqlite_timestamp(datetime.now()))
+                )
+                print(f"🔧 Применена миграция {version}: {description}")
+        
+        print(f"✅ База данных SQLite инициализирована ({self.path})")
+    
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        # Потоки пула откроют новые соединения при следующем обращении
+        self._local = threading.local()
+    
+    def connection_stats(self):
+        with self._lock:
+            return {"open": len(self._connections), "in_use": self._in_use}
+    
+    def list_id_exists(self, list_id):
+        with self._transaction() as conn:
+            return conn.execute("SELECT 1 FROM lists WHERE id = ?", (list_id,)).fetchone() is not None
+    
+    def find_list_by_message(self, guild_id, message_id):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id FROM lists WHERE message_id = ? AND guild_id = ?", (message_id, guild_id)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def create_new_list(self, list_id, list_name, channel_id, static_channel_id, created_by, guild_id):
+        created_at = datetime.now()
+        
+        with self._transaction(write=True) as conn:
+            conn.execute('''
+                INSERT INTO lists (id, name, channel_id, static_channel_id, created_by, guild_id, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (list_id, list_name, channel_id, static_channel_id, created_by, guild_id, _sqlite_timestamp(created_at)))
+        
+        return ListState(
+            id=list_id,
+            name=list_name,
+            channel_id=channel_id,
+            static_channel_id=static_channel_id,
+            created_by=created_by,
+            guild_id=guild_id,
+            created_at=created_at
+        )
     
-    conn.commit()
-    conn.close()
-    return True
-
-def get_all_lists(guild_id):
-    """Получает все списки для сервера"""
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    def get_list(self, list_id, guild_id):
+        # Несколько запросов в одной читающей транзакции видят один снимок
+        with self._transaction() as conn:
+            row = conn.execute('''
+                SELECT id, name, channel_id, static_channel_id, created_by, guild_id, created_at,
+                       message_id, status_message_id, message_hash, status_message_hash
+                FROM lists WHERE id = ? AND guild_id = ?
+            ''', (list_id, guild_id)).fetchone()
+            if not row:
+                return None
+            
+            participant_rows = conn.execute('''
+                SELECT user_id, display_name, has_rollback, registered_at, chunk_index FROM participants
+                WHERE list_id = ? ORDER BY registered_at, id
+            ''', (list_id,)).fetchall()
+            rollback_rows = conn.execute('''
+                SELECT user_id, user_name, text, timestamp FROM rollbacks
+                WHERE list_id = ? ORDER BY timestamp, id
+            ''', (list_id,)).fetchall()
+            chunk_rows = conn.execute('''
+                SELECT chunk_index, message_id, content_hash FROM status_chunks
+                WHERE list_id = ? ORDER BY chunk_index
+            ''', (list_id,)).fetchall()
+        
+        (list_id, name, channel_id, static_channel_id, created_by, guild_id, created_at,
+         message_id, status_message_id, message_hash, status_message_hash) = row
+        
+        return ListState(
+            id=list_id,
+            name=name,
+            channel_id=channel_id,
+            static_channel_id=static_channel_id,
+            created_by=created_by,
+            guild_id=guild_id,
+            created_at=datetime.fromisoformat(created_at),
+            message_id=message_id,
+            status_message_id=status_message_id,
+            message_hash=message_hash,
+            status_message_hash=status_message_hash,
+            participants={
+                user_id: Participant(
+                    user_id, display_name, bool(has_rollback), datetime.fromisoformat(registered_at), chunk_index
+                )
+                for user_id, display_name, has_rollback, registered_at, chunk_index in participant_rows
+            },
+            rollbacks=[
+                Rollback(user_id, user_name, text, datetime.fromisoformat(timestamp))
+                for user_id, user_name, text, timestamp in rollback_rows
+            ],
+            status_chunks={
+                chunk_index: StatusChunk(message_id, content_hash)
+                for chunk_index, message_id, content_hash in chunk_rows
+            }
+        )
+    
+    def save_participants_message(self, list_id, message_id, message_hash):
+        with self._transaction(write=True) as conn:
+            conn.execute(
+                "UPDATE lists SET message_id = ?, message_hash = ? WHERE id = ?",
+                (message_id, message_hash, list_id)
+            )
+    
+    def save_status_message(self, list_id, message_id, message_hash):
+        with self._transaction(write=True) as conn:
+            conn.execute(
+                "UPDATE lists SET status_message_id = ?, status_message_hash = ? WHERE id = ?",
+                (message_id, message_hash, list_id)
+            )
     
-    cursor.execute("SELECT * FROM lists WHERE guild_id = %s", (guild_id,))
-    lists = [dict(row) for row in cursor.fetchall()]
+    def register_participant(self, list_id, user_id, display_name):
+        registered = self.register_participants(list_id, [(user_id, display_name)])
+        return registered[0] if registered else None
+    
+    def register_participants(self, list_id, members):
+        registered_at = datetime.now()
+        # BEGIN IMMEDIATE уже выстраивает запись в очередь: места в блоках
+        # считаются по занятости, которую никто не изменит до коммита
+        with self._transaction(write=True) as conn:
+            if conn.execute("SELECT 1 FROM lists WHERE id = ?", (list_id,)).fetchone() is None:
+                return None
+            
+            registered = {
+                row[0] for row in conn.execute("SELECT user_id FROM participants WHERE list_id = ?", (list_id,))
+            }
+            new_members = [(user_id, name) for user_id, name in dict(members).items() if user_id not in registered]
+            if not new_members:
+                return []
+            
+            chunk_sizes = dict(conn.execute(
+                "SELECT chunk_index, COUNT(*) FROM participants WHERE list_id = ? GROUP BY chunk_index", (list_id,)
+            ).fetchall())
+            participants = [
+                Participant(user_id, display_name, False, registered_at, chunk_index)
+                for (user_id, display_name), chunk_index in zip(new_members, assign_chunk_slots(chunk_sizes, len(new_members)))
+            ]
+            conn.executemany('''
+                INSERT INTO participants (list_id, user_id, display_name, has_rollback, registered_at, chunk_index)
+                VALUES (?, ?, ?, 0, ?, ?)
+            ''', [(list_id, p.user_id, p.display_name, _sqlite_timestamp(registered_at), p.chunk_index) for p in participants])
+        return participants
+    
+    def save_status_chunk(self, list_id, chunk_index, chunk):
+        with self._transaction(write=True) as conn:
+            conn.execute('''
+                INSERT INTO status_chunks (list_id, chunk_index, message_id, content_hash)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (list_id, chunk_index)
+                DO UPDATE SET message_id = excluded.message_id, content_hash = excluded.content_hash
+            ''', (list_id, chunk_index, chunk.message_id, chunk.content_hash))
+    
+    def delete_status_chunk(self, list_id, chunk_index):
+        with self._transaction(write=True) as conn:
+            conn.execute("DELETE FROM status_chunks WHERE list_id = ? AND chunk_index = ?", (list_id, chunk_index))
+    
+    def remove_participant(self, list_id, user_id):
+        with self._transaction(write=True) as conn:
+            conn.execute("DELETE FROM rollbacks WHERE list_id = ? AND user_id = ?", (list_id, user_id))
+            cursor = conn.execute("DELETE FROM participants WHERE list_id = ? AND user_id = ?", (list_id, user_id))
+            return cursor.rowcount > 0
+    
+    def replace_rollback(self, list_id, user_id, user_name, text):
+        timestamp = datetime.now()
+        with self._transaction(write=True) as conn:
+            cursor = conn.execute(
+                "UPDATE participants SET has_rollback = 1 WHERE list_id = ? AND user_id = ?", (list_id, user_id)
+            )
+            if not cursor.rowcount:
+                return None
+            conn.execute('''
+                INSERT INTO rollbacks (list_id, user_id, user_name, text, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (list_id, user_id)
+                DO UPDATE SET user_name = excluded.user_name, text = excluded.text, timestamp = excluded.timestamp
+            ''', (list_id, user_id, user_name, text, _sqlite_timestamp(timestamp)))
+        
+        return Rollback(user_id, user_name, text, timestamp)
+    
+    def remove_user_rollback(self, list_id, user_id):
+        with self._transaction(write=True) as conn:
+            cursor = conn.execute("DELETE FROM rollbacks WHERE list_id = ? AND user_id = ?", (list_id, user_id))
+            conn.execute("UPDATE participants SET has_rollback = 0 WHERE list_id = ? AND user_id = ?", (list_id, user_id))
+            return cursor.rowcount > 0
+    
+    def get_all_lists(self, guild_id, page=0, page_size=LISTS_PAGE_SIZE):
+        with self._transaction() as conn:
+            rows = conn.execute('''
+                SELECT l.id, l.name,
+                       (SELECT COUNT(*) FROM participants p WHERE p.list_id = l.id),
+                       (SELECT COUNT(*) FROM participants p WHERE p.list_id = l.id AND p.has_rollback)
+                FROM (
+                    SELECT id, name, created_at FROM lists
+                    WHERE guild_id = ?
+                    ORDER BY created_at DESC, id
+                    LIMIT ? OFFSET ?
+                ) l
+                ORDER BY l.created_at DESC, l.id
+            ''', (guild_id, page_size, page * page_size)).fetchall()
+            total = conn.execute("SELECT COUNT(*) FROM lists WHERE guild_id = ?", (guild_id,)).fetchone()[0]
+        
+        return [ListSummary(*row) for row in rows], total
+    
+    def count_lists(self):
+        with self._transaction() as conn:
+            return conn.execute("SELECT COUNT(*) FROM lists").fetchone()[0]
+    
+    def get_guild_list_names(self, guild_id):
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT id, name, created_at FROM lists WHERE guild_id = ?", (guild_id,)).fetchall()
+        return [(list_id, name, datetime.fromisoformat(created_at)) for list_id, name, created_at in rows]
+    
+    def delete_list_from_db(self, list_id):
+        with self._transaction(write=True) as conn:
+            conn.execute("DELETE FROM lists WHERE id = ?", (list_id,))
+    
+    def reset_list_rollbacks(self, list_id):
+        with self._transaction(write=True) as conn:
+            conn.execute("DELETE FROM rollbacks WHERE list_id = ?", (list_id,))
+            conn.execute("UPDATE participants SET has_rollback = 0 WHERE list_id = ?", (list_id,))
+    
+    def search_rollbacks(self, guild_id, query, since=None, page=0, page_size=SEARCH_PAGE_SIZE):
+        # Слова запроса - в кавычках, чтобы синтаксис FTS5 не ломал поиск, и с
+        # поиском по началу слова: стемминга для русского в FTS5 нет
+        words = re.findall(r"\w+", query)
+        if not words:
+            return [], False
+        match = " ".join(f'"{word}"*' for word in words)
+        since = _sqlite_timestamp(since) if since else None
+        
+        with self._transaction() as conn:
+            rows = conn.execute('''
+                SELECT r.list_id, l.name, r.user_name,
+                       snippet(rollbacks_fts, 0, '**', '**', '…', 24), r.timestamp
+                FROM rollbacks_fts
+                JOIN rollbacks r ON r.id = rollbacks_fts.rowid
+                JOIN lists l ON l.id = r.list_id
+                WHERE rollbacks_fts MATCH ? AND l.guild_id = ? AND (? IS NULL OR r.timestamp >= ?)
+                ORDER BY bm25(rollbacks_fts), r.timestamp DESC, r.id
+                LIMIT ? OFFSET ?
+            ''', (match, guild_id, since, since, page_size + 1, page * page_size)).fetchall()
+        
+        matches = [
+            RollbackMatch(list_id, list_name, user_name, snippet, datetime.fromisoformat(timestamp))
+            for list_id, list_name, user_name, snippet, timestamp in rows[:page_size]
+        ]
+        return matches, len(rows) > page_size
     
-    for list_item in lists:
-        cursor.execute("SELECT COUNT(*) as count FROM participants WHERE list_id = %s", (list_item["id"],))
-        list_item["participants_count"] = cursor.fetchone()["count"]
+    def get_guild_configs(self):
+        with self._transaction() as conn:
+            config_rows = conn.execute("SELECT guild_id, static_channel_id FROM guild_configs").fetchall()
+            admin_rows = conn.execute("SELECT guild_id, kind, target_id FROM guild_admins").fetchall()
+        
+        admins = {}
+        for guild_id, kind, target_id in admin_rows:
+            admins.setdefault((guild_id, kind), set()).add(target_id)
+        return [
+            GuildConfig(
+                guild_id, static_channel_id,
+                frozenset(admins.get((guild_id, "role"), ())),
+                frozenset(admins.get((guild_id, "user"), ()))
+            )
+            for guild_id, static_channel_id in config_rows
+        ]
+    
+    def publish_config_change(self):
+        # Других процессов у файла SQLite нет
+        pass
+
+def create_storage():
+    """Хранилище по STORAGE_BACKEND: postgres (по умолчанию) или sqlite"""
+    if STORAGE_BACKEND == "postgres":
+        return PostgresStorage()
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(SQLITE_PATH)
+    raise ValueError(f"Неизвестное хранилище STORAGE_BACKEND={STORAGE_BACKEND!r}")
+
+storage = create_storage()
+if MULTI_PROCESS and not storage.supports_change_feed:
+    raise ValueError("Несколько процессов (INSTANCE_COUNT или часть шардов в SHARD_IDS) требуют хранилища PostgreSQL")
+
+# Кэш состояния списков в памяти процесса
+LIST_CACHE_MAX_SIZE = int(os.getenv("LIST_CACHE_MAX_SIZE", "256"))
+LIST_CACHE_TTL = float(os.getenv("LIST_CACHE_TTL", "600"))
+
+class ListCache:
+    """LRU-кэш состояния списков с TTL и ограничением размера.
+    
+    Ключ - (guild_id, list_id). Мутации обновляют закэшированное состояние
+    после коммита (write-through), поэтому чтения активных списков не идут в БД.
+    Используется только из цикла событий, блокировки не нужны.
+    """
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys = {}
+        # Версия списка увеличивается при каждой мутации: чтение, начатое
+        # до мутации, не должно положить в кэш устаревшее состояние.
+        # Версии хранятся только для списков, которые сейчас читаются из БД
+        # (_loading - число таких чтений). Эпоха увеличивается при полном сбросе кэша
+        self._versions = {}
+        self._loading = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, guild_id, list_id):
+        key = (guild_id, list_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        expires_at, list_data = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return list_data
+    
+    def peek(self, list_id):
+        """Возвращает закэшированный список без учёта статистики и LRU"""
+        key = self._keys.get(list_id)
+        if key is None:
+            return None
+        return self._entries[key][1]
+    
+    def touch(self, list_id):
+        """Отмечает мутацию списка и возвращает закэшированное состояние для обновления"""
+        self._bump(list_id)
+        return self.peek(list_id)
+    
+    def begin_load(self, list_id):
+        """Отмечает начало чтения списка из БД; возвращает версию для end_load"""
+        self._loading[list_id] = self._loading.get(list_id, 0) + 1
+        return self._epoch, self._versions.get(list_id, 0)
+    
+    def end_load(self, list_id, version):
+        """Завершает чтение; True, если список не менялся, пока оно шло"""
+        fresh = (self._epoch, self._versions.get(list_id, 0)) == version
+        remaining = self._loading.pop(list_id) - 1
+        if remaining:
+            self._loading[list_id] = remaining
+        else:
+            self._versions.pop(list_id, None)
+        return fresh
+    
+    def put(self, list_data):
+        key = (list_data.guild_id, list_data.id)
+        self._entries[key] = (time.monotonic() + self.ttl, list_data)
+        self._entries.move_to_end(key)
+        self._keys[list_data.id] = key
+        
+        while len(self._entries) > self.max_size:
+            old_key, _ = self._entries.popitem(last=False)
+            self._keys.pop(old_key[1], None)
+            self.evictions += 1
+    
+    def put_loaded(self, list_data):
+        """Кэширует прочитанное из БД состояние (после успешного end_load)"""
+        cached = self.peek(list_data.id)
+        if cached is not None:
+            # Пока шло чтение, список уже попал в кэш - отдаём его, чтобы не было двух копий
+            return cached
+        self.put(list_data)
+        return list_data
+    
+    def invalidate(self, list_id):
+        self._bump(list_id)
+        key = self._keys.get(list_id)
+        if key is not None:
+            self._remove(key)
+    
+    def clear(self):
+        """Сбрасывает весь кэш; чтения, начатые до сброса, в кэш не попадут"""
+        self._epoch += 1
+        self._entries.clear()
+        self._keys.clear()
+    
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        self._keys.pop(key[1], None)
+    
+    def _bump(self, list_id):
+        # Без идущих чтений версию сравнивать не с чем
+        if list_id in self._loading:
+            self._versions[list_id] = self._versions.get(list_id, 0) + 1
+    
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+list_cache = ListCache(LIST_CACHE_MAX_SIZE, LIST_CACHE_TTL)
+
+# Ограничения Discord на ответ автодополнения
+AUTOCOMPLETE_MAX_CHOICES = 25
+AUTOCOMPLETE_CHOICE_LENGTH = 100
+
+class ListIndex:
+    """Индекс списков по серверам для автодополнения list_id.
+    
+    Списки сервера читаются из БД один раз при первом обращении, дальше индекс
+    поддерживается при создании и удалении списков. ID сервера хранятся
+    отсортированными: поиск по началу ID - бинарный.
+    """
+    
+    def __init__(self):
+        # guild_id -> {list_id: (created_at, name, name.casefold())}
+        self._entries = {}
+        # guild_id -> отсортированные ID списков
+        self._sorted_ids = {}
+        # Версия сервера увеличивается при каждом изменении: загрузка, во время
+        # которой списки менялись, повторяется
+        self._versions = {}
+        self._loading = {}
+    
+    async def ensure_loaded(self, guild_id):
+        if guild_id in self._entries:
+            return
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(guild_id))
+            self._loading[guild_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+        # Отмена одного автодополнения не должна отменять общую загрузку
+        await asyncio.shield(task)
+    
+    async def _load(self, guild_id):
+        while True:
+            version = self._versions.get(guild_id, 0)
+            rows = await run_db(storage.get_guild_list_names, guild_id)
+            if self._versions.get(guild_id, 0) == version:
+                break
+        
+        self._entries[guild_id] = {
+            list_id: (created_at, name, name.casefold()) for list_id, name, created_at in rows
+        }
+        self._sorted_ids[guild_id] = sorted(self._entries[guild_id])
+    
+    def add(self, guild_id, list_id, name, created_at):
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        entries = self._entries.get(guild_id)
+        if entries is None:
+            # Сервер ещё не загружен - список попадёт в индекс при загрузке
+            return
+        if list_id not in entries:
+            bisect.insort(self._sorted_ids[guild_id], list_id)
+        entries[list_id] = (created_at, name, name.casefold())
+    
+    def remove(self, guild_id, list_id):
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        entries = self._entries.get(guild_id)
+        if entries is None or entries.pop(list_id, None) is None:
+            return
+        ids = self._sorted_ids[guild_id]
+        del ids[bisect.bisect_left(ids, list_id)]
+    
+    def invalidate(self, guild_id):
+        """Забывает списки сервера: они перечитаются при следующем обращении"""
+        self._versions[guild_id] = self._versions.get(guild_id, 0) + 1
+        self._entries.pop(guild_id, None)
+        self._sorted_ids.pop(guild_id, None)
+    
+    def clear(self):
+        for guild_id in set(self._entries) | set(self._loading):
+            self.invalidate(guild_id)
+    
+    def search(self, guild_id, query, limit=AUTOCOMPLETE_MAX_CHOICES):
+        """Возвращает пары (list_id, name): сначала совпадения по началу ID, затем по названию"""
+        entries = self._entries.get(guild_id, {})
+        query = query.strip()
+        if not query:
+            newest = heapq.nlargest(limit, entries.items(), key=lambda item: item[1][0])
+            return [(list_id, entry[1]) for list_id, entry in newest]
+        
+        ids = self._sorted_ids.get(guild_id, [])
+        prefix = query.upper()
+        matches = []
+        for position in range(bisect.bisect_left(ids, prefix), len(ids)):
+            list_id = ids[position]
+            if not list_id.startswith(prefix) or len(matches) >= limit:
+                break
+            matches.append((list_id, entries[list_id][1]))
         
-        cursor.execute("SELECT COUNT(*) as count FROM participants WHERE list_id = %s AND has_rollback = TRUE", (list_item["id"],))
-        list_item["rollbacks_count"] = cursor.fetchone()["count"]
+        if len(matches) < limit:
+            needle = query.casefold()
+            found = {list_id for list_id, _ in matches}
+            by_name = heapq.nlargest(
+                limit - len(matches),
+                (item for item in entries.items() if needle in item[1][2] and item[0] not in found),
+                key=lambda item: item[1][0]
+            )
+            matches.extend((list_id, entry[1]) for list_id, entry in by_name)
+        return matches
+
+list_index = ListIndex()
+
+# Метрики в текстовом формате Prometheus. Собираются всегда, HTTP-экспортёр
+# поднимается только при заданном METRICS_PORT
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_PREFIX = "rollback_bot"
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = []
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+class Metric:
+    """Базовая метрика: значения по наборам меток либо значение из функции source"""
+    kind = "untyped"
+    
+    def __init__(self, name, help_text, source=None):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.help_text = help_text
+        self.source = source
+        self._values = {}
+        METRICS.append(self)
+    
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        if self.source is not None:
+            lines.append(f"{self.name} {self.source()}")
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+    
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
     
-    conn.close()
-    return lists
+    def set(self, value, **labels):
+        self._values[tuple(sorted(labels.items()))] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+    
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = buckets
+    
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._values.get(key)
+        if series is None:
+            # Счётчики по корзинам (последняя - +Inf) и сумма наблюдений
+            series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+    
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+    
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels((*labels, ('le', bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+class RateLimitLogHandler(logging.Handler):
+    """Считает ответы 429 по предупреждениям логгера disnake.http.
+    
+    disnake сам ждёт Retry-After и повторяет запрос, наружу 429 не доходит -
+    остаётся только запись в лог. Сами записи обработчик не выводит.
+    """
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.rate_limited = 0
+    
+    def emit(self, record):
+        if str(record.msg).startswith("We are being rate limited"):
+            self.rate_limited += 1
+
+def timed(histogram, **labels):
+    """Декоратор: замеряет время выполнения корутинной функции"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+DB_SECONDS = Histogram("db_seconds", "Время вызова функций работы с БД, включая ожидание потока")
+STEP_SECONDS = Histogram("step_seconds", "Время шагов горячего пути: чтение списка, регистрация, отрисовка")
+INTERACTION_SECONDS = Histogram("interaction_seconds", "Время обработки команд, кнопок и модальных окон")
+DISCORD_SECONDS = Histogram("discord_request_seconds", "Задержка запросов к Discord REST")
+ACTIVE_LISTS = Gauge("active_lists", "Списков в базе")
+rate_limit_log = RateLimitLogHandler()
+logging.getLogger("disnake.http").addHandler(rate_limit_log)
+Counter("discord_rate_limited_total", "Ответов 429 от Discord", source=lambda: rate_limit_log.rate_limited)
+Counter("outbox_superseded_total", "Запросов к Discord, вытесненных более новыми", source=lambda: outbox.dropped)
+Gauge("outbox_pending", "Запросов к Discord в очереди", source=lambda: outbox.pending())
+Gauge("render_pending", "Списков, ожидающих перерисовки", source=lambda: len(_dirty_lists) + len(_render_tasks))
+Gauge("list_cache_size", "Списков в кэше", source=lambda: len(list_cache))
+Counter("list_cache_hits_total", "Попаданий в кэш списков", source=lambda: list_cache.hits)
+Counter("list_cache_misses_total", "Промахов кэша списков", source=lambda: list_cache.misses)
+Counter("list_cache_evictions_total", "Вытеснений из кэша списков", source=lambda: list_cache.evictions)
+Gauge("display_name_cache_size", "Имён пользователей в кэше", source=lambda: len(display_names))
+Counter("display_name_cache_hits_total", "Попаданий в кэш имён", source=lambda: display_names.hits)
+Counter("display_name_cache_misses_total", "Промахов кэша имён", source=lambda: display_names.misses)
+Gauge("db_connections_open", "Открытых соединений с БД",
+      source=lambda: storage.connection_stats()["open"])
+Gauge("db_connections_in_use", "Занятых соединений с БД",
+      source=lambda: storage.connection_stats()["in_use"])
+Gauge("change_feed_connected", "Подписка на изменения других процессов активна",
+      source=lambda: int(change_feed.connected))
+Counter("change_feed_received_total", "Изменений списков, полученных от других процессов",
+        source=lambda: change_feed.received)
+
+def render_metrics():
+    return "\n".join(line for metric in METRICS for line in metric.collect()) + "\n"
+
+async def metrics_handler(request):
+    try:
+        ACTIVE_LISTS.set(await run_db(storage.count_lists))
+    except Exception as e:
+        print(f"Ошибка при подсчёте списков для метрик: {e}")
+    return web.Response(text=render_metrics(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+_metrics_runner = None
+
+async def start_metrics_server():
+    """Поднимает HTTP-эндпоинт /metrics, если задан METRICS_PORT"""
+    global _metrics_runner
+    if not METRICS_PORT or _metrics_runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    _metrics_runner = web.AppRunner(app, access_log=None)
+    await _metrics_runner.setup()
+    await web.TCPSite(_metrics_runner, "0.0.0.0", METRICS_PORT).start()
+    print(f"📈 Метрики доступны на порту {METRICS_PORT}: /metrics")
+
+# Асинхронный слой доступа к данным: запросы выполняются в отдельном пуле потоков,
+# поэтому медленный запрос не останавливает цикл событий и heartbeat шлюза
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", str(DB_POOL_MAX)))
+_db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+# Шард, от имени которого работает текущая задача: задаётся в точках входа
+# (взаимодействия, перерисовка) и наследуется порождёнными задачами
+_current_shard = contextvars.ContextVar("current_shard", default=None)
+_shard_db_budgets = {}
+_shard_render_slots = {}
+
+def shard_for_guild(guild_id):
+    return (guild_id >> 22) % (bot.shard_count or 1)
+
+def enter_shard(guild_id):
+    """Относит дальнейшие запросы к БД текущей задачи к шарду сервера"""
+    if SHARD_COUNT and guild_id is not None:
+        _current_shard.set(shard_for_guild(guild_id))
+
+def local_shard_count():
+    return len(SHARD_IDS) or bot.shard_count or 1
+
+def shard_db_budget():
+    """Семафор соединений с БД шарда текущей задачи; вне шарда - без ограничения"""
+    shard_id = _current_shard.get()
+    if shard_id is None:
+        return nullcontext()
+    budget = _shard_db_budgets.get(shard_id)
+    if budget is None:
+        budget = asyncio.Semaphore(DB_CONNECTIONS_PER_SHARD or max(1, DB_POOL_MAX // local_shard_count()))
+        _shard_db_budgets[shard_id] = budget
+    return budget
+
+def shard_render_slots(guild_id):
+    """Семафор одновременных перерисовок шарда сервера"""
+    if not SHARD_COUNT:
+        return nullcontext()
+    shard_id = shard_for_guild(guild_id)
+    slots = _shard_render_slots.get(shard_id)
+    if slots is None:
+        slots = asyncio.Semaphore(RENDER_WORKERS_PER_SHARD)
+        _shard_render_slots[shard_id] = slots
+    return slots
+
+async def run_db(func, *args):
+    """Выполняет синхронную функцию работы с БД в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    async with shard_db_budget():
+        with DB_SECONDS.time(helper=func.__name__):
+            return await loop.run_in_executor(_db_executor, functools.partial(func, *args))
 
-def delete_list_from_db(list_id):
-    """Удаляет список из базы данных"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+async def list_id_exists(list_id):
+    return await run_db(storage.list_id_exists, list_id)
+
+async def find_list_by_message(guild_id, message_id):
+    return await run_db(storage.find_list_by_message, guild_id, message_id)
+
+async def create_new_list(list_id, list_name, channel_id, created_by, guild_id):
+    config = get_server_config(guild_id)
+    static_channel_id = config.static_channel_id if config else channel_id
+    list_data = await run_db(
+        storage.create_new_list, list_id, list_name, channel_id, static_channel_id, created_by, guild_id
+    )
+    list_cache.put(list_data)
+    list_index.add(guild_id, list_id, list_name, list_data.created_at)
+    return list_data
+
+@timed(STEP_SECONDS, step="get_list")
+async def get_list(list_id, guild_id):
+    list_data = list_cache.get(guild_id, list_id)
+    if list_data is not None:
+        return list_data
     
-    cursor.execute("DELETE FROM lists WHERE id = %s", (list_id,))
-    conn.commit()
-    conn.close()
+    version = list_cache.begin_load(list_id)
+    try:
+        list_data = await run_db(storage.get_list, list_id, guild_id)
+    finally:
+        fresh = list_cache.end_load(list_id, version)
+    if list_data is not None and fresh:
+        list_data = list_cache.put_loaded(list_data)
+    return list_data
+
+async def save_participants_message(list_data):
+    await run_db(storage.save_participants_message, list_data.id, list_data.message_id, list_data.message_hash)
+    cached = list_cache.peek(list_data.id)
+    if cached is not None and cached is not list_data:
+        cached.message_id = list_data.message_id
+        cached.message_hash = list_data.message_hash
+
+async def save_status_message(list_data):
+    await run_db(storage.save_status_message, list_data.id, list_data.status_message_id, list_data.status_message_hash)
+    cached = list_cache.peek(list_data.id)
+    if cached is not None and cached is not list_data:
+        cached.status_message_id = list_data.status_message_id
+        cached.status_message_hash = list_data.status_message_hash
+
+async def save_status_chunk(list_data, chunk_index):
+    chunk = list_data.status_chunks[chunk_index]
+    await run_db(storage.save_status_chunk, list_data.id, chunk_index, chunk)
+    cached = list_cache.peek(list_data.id)
+    if cached is not None and cached is not list_data:
+        cached.status_chunks[chunk_index] = chunk
 
-def reset_list_rollbacks(list_id):
-    """Сбрасывает все откаты в списке"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+async def delete_status_chunk(list_data, chunk_index):
+    await run_db(storage.delete_status_chunk, list_data.id, chunk_index)
+    cached = list_cache.peek(list_data.id)
+    if cached is not None and cached is not list_data:
+        cached.status_chunks.pop(chunk_index, None)
+
+@timed(STEP_SECONDS, step="register_participant")
+async def register_participant(list_id, user_id, display_name):
+    participant = await run_db(storage.register_participant, list_id, user_id, display_name)
+    if participant is None:
+        return False
     
-    cursor.execute("DELETE FROM rollbacks WHERE list_id = %s", (list_id,))
-    cursor.execute('''
-        UPDATE participants SET has_rollback = FALSE 
-        WHERE list_id = %s
-    ''', (list_id,))
+    cached = list_cache.touch(list_id)
+    if cached is not None:
+        cached.participants[user_id] = participant
+    return True
+
+@timed(STEP_SECONDS, step="register_participants")
+async def register_participants(list_id, members):
+    """Регистрирует пачку участников; возвращает множество ID новых участников.
+    
+    None - список удалён.
+    """
+    participants = await run_db(storage.register_participants, list_id, members)
+    if participants is None:
+        list_cache.invalidate(list_id)
+        return None
+    cached = list_cache.touch(list_id)
+    if cached is not None:
+        for participant in participants:
+            cached.participants[participant.user_id] = participant
+    return {participant.user_id for participant in participants}
+
+async def remove_participant(list_id, user_id):
+    removed = await run_db(storage.remove_participant, list_id, user_id)
+    cached = list_cache.touch(list_id)
+    if cached is not None:
+        cached.participants.pop(user_id, None)
+        cached.rollbacks = [r for r in cached.rollbacks if r.user_id != user_id]
+    return removed
+
+@timed(STEP_SECONDS, step="replace_rollback")
+async def replace_rollback(list_id, user_id, user_name, text):
+    rollback = await run_db(storage.replace_rollback, list_id, user_id, user_name, text)
+    if rollback is None:
+        # Участника уже нет в БД - закэшированное состояние устарело
+        list_cache.invalidate(list_id)
+        return None
     
-    conn.commit()
-    conn.close()
+    cached = list_cache.touch(list_id)
+    if cached is not None:
+        cached.rollbacks = [r for r in cached.rollbacks if r.user_id != user_id]
+        cached.rollbacks.append(rollback)
+        if user_id in cached.participants:
+            cached.participants[user_id].has_rollback = True
+    return rollback
+
+async def remove_user_rollback(list_id, user_id):
+    removed = await run_db(storage.remove_user_rollback, list_id, user_id)
+    cached = list_cache.touch(list_id)
+    if cached is not None:
+        cached.rollbacks = [r for r in cached.rollbacks if r.user_id != user_id]
+        if user_id in cached.participants:
+            cached.participants[user_id].has_rollback = False
+    return removed
+
+async def get_all_lists(guild_id, page=0, page_size=LISTS_PAGE_SIZE):
+    return await run_db(storage.get_all_lists, guild_id, page, page_size)
+
+async def search_rollbacks(guild_id, query, since=None, page=0):
+    return await run_db(storage.search_rollbacks, guild_id, query, since, page)
+
+async def delete_list_from_db(list_id, guild_id):
+    await run_db(storage.delete_list_from_db, list_id)
+    list_cache.invalidate(list_id)
+    list_index.remove(guild_id, list_id)
+    _status_parts_requested.pop(list_id, None)
+
+async def reset_list_rollbacks(list_id):
+    await run_db(storage.reset_list_rollbacks, list_id)
+    cached = list_cache.touch(list_id)
+    if cached is not None:
+        cached.rollbacks = []
+        for participant in cached.participants.values():
+            participant.has_rollback = False
+
+# Снимок настроек серверов: guild_id -> GuildConfig. При перезагрузке словарь
+# заменяется целиком, поэтому читатели всегда видят согласованный снимок
+guild_configs = {}
+
+def apply_guild_configs(configs):
+    global guild_configs
+    guild_configs = {config.guild_id: config for config in configs}
+
+def load_guild_configs():
+    """Загружает настройки серверов при запуске, до подключения к Discord"""
+    apply_guild_configs(storage.get_guild_configs())
+
+async def reload_guild_configs():
+    """Перечитывает настройки серверов из базы; возвращает число серверов"""
+    apply_guild_configs(await run_db(storage.get_guild_configs))
+    return len(guild_configs)
 
-# Остальные функции без изменений
 def get_server_config(guild_id):
-    return SERVER_CONFIGS.get(guild_id)
+    return guild_configs.get(guild_id)
 
 def is_admin(member):
     if not member:
@@ -313,19 +2168,11 @@ def is_admin(member):
     if not config:
         return False
     
-    if member.guild.id == 1429544000188317831:
-        try:
-            member_role_ids = [role.id for role in member.roles]
-            return any(role_id in config["admin_role_ids"] for role_id in member_role_ids)
-        except:
-            return False
-    elif member.guild.id == 1003525677640851496:
-        try:
-            return member.id in config["admin_ids"]
-        except:
-            return False
-    
-    return False
+    if member.id in config.admin_user_ids:
+        return True
+    return not config.admin_role_ids.isdisjoint(role.id for role in member.roles)
+
+# Остальные функции без изменений
 
 def generate_list_id():
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
@@ -340,69 +2187,319 @@ def clean_rollback_text(text):
     
     return clean_text
 
+# Очередь отрисовок в Discord: у каждого канала своя корзина, внутри корзины
+# запросы идут по порядку постановки. Ответы на взаимодействия идут мимо очереди:
+# у них свои лимиты по токену взаимодействия
+class DiscordOutbox:
+    """Очередь запросов к Discord с корзинами по каналам.
+    
+    Запрос с supersede_key отбрасывается, если до его выполнения в очередь
+    поставлен более новый запрос с тем же ключом (например, новая отрисовка
+    того же сообщения). Ответы 429 повторяет сам disnake.
+    """
+    
+    def __init__(self):
+        self._queues = {}
+        self._workers = {}
+        self._latest = {}
+        self._seq = itertools.count()
+        self.dropped = 0
+    
+    def submit(self, channel_id, func, supersede_key=None):
+        """Ставит корутинную функцию в очередь канала; возвращает future с её результатом"""
+        future = asyncio.get_running_loop().create_future()
+        seq = next(self._seq)
+        if supersede_key is not None:
+            self._latest[supersede_key] = seq
+        
+        queue = self._queues.get(channel_id)
+        if queue is None:
+            queue = self._queues[channel_id] = asyncio.Queue()
+        queue.put_nowait((seq, supersede_key, func, future))
+        
+        worker = self._workers.get(channel_id)
+        if worker is None or worker.done():
+            self._workers[channel_id] = asyncio.create_task(self._run(channel_id, queue))
+        return future
+    
+    def pending(self):
+        return sum(queue.qsize() for queue in self._queues.values())
+    
+    async def _run(self, channel_id, queue):
+        while not queue.empty():
+            seq, supersede_key, func, future = queue.get_nowait()
+            
+            if supersede_key is not None and self._latest.get(supersede_key) != seq:
+                # Более новая отрисовка того же сообщения уже в очереди
+                self.dropped += 1
+                if not future.done():
+                    future.set_result(None)
+                continue
+            
+            try:
+                result = await func()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                if supersede_key is not None and self._latest.get(supersede_key) == seq:
+                    del self._latest[supersede_key]
+        
+        self._workers.pop(channel_id, None)
+        self._queues.pop(channel_id, None)
+
+outbox = DiscordOutbox()
+
+async def reply(inter, content=None, **kwargs):
+    """Эфемерный ответ на взаимодействие"""
+    kwargs.setdefault("ephemeral", True)
+    await inter.response.send_message(content, **kwargs)
+
+async def replace_reply(inter, content=None, **kwargs):
+    """Отвечает на нажатие кнопки, заменяя сообщение с кнопками"""
+    await inter.response.edit_message(content=content, **kwargs)
+
+async def edit_reply(inter, content=None, **kwargs):
+    """Заменяет отложенный (defer) ответ на взаимодействие"""
+    await inter.edit_original_response(content=content, **kwargs)
+
+# Сколько пользователей одновременно запрашивается у Discord при регистрации
+MEMBER_FETCH_CONCURRENCY = 5
+_member_fetch_slots = asyncio.Semaphore(MEMBER_FETCH_CONCURRENCY)
+
+DISPLAY_NAME_CACHE_MAX_SIZE = int(os.getenv("DISPLAY_NAME_CACHE_MAX_SIZE", "10000"))
+DISPLAY_NAME_CACHE_TTL = float(os.getenv("DISPLAY_NAME_CACHE_TTL", "3600"))
+
+class DisplayNameCache:
+    """LRU-кэш отображаемых имён пользователей на серверах с TTL.
+    
+    Ключ - (guild_id, user_id). Заполняется при запросе имён у Discord,
+    событие изменения участника обновляет только уже известные имена.
+    """
+    
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, guild_id, user_id):
+        key = (guild_id, user_id)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def put(self, guild_id, user_id, name):
+        key = (guild_id, user_id)
+        self._entries[key] = (time.monotonic() + self.ttl, name)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def refresh(self, guild_id, user_id, name):
+        """Обновляет имя, если пользователь уже есть в кэше"""
+        if (guild_id, user_id) in self._entries:
+            self.put(guild_id, user_id, name)
+
+display_names = DisplayNameCache(DISPLAY_NAME_CACHE_MAX_SIZE, DISPLAY_NAME_CACHE_TTL)
+
+async def resolve_display_name(guild, user_id, user=None):
+    """Отображаемое имя пользователя на сервере или None, если его не получить.
+    
+    Сначала кэш участников библиотеки (в экономном режиме он пуст), затем
+    кэш имён, затем переданный участник и только потом запрос к Discord.
+    """
+    member = guild.get_member(user_id)
+    if member is not None:
+        return member.display_name
+    
+    name = display_names.get(guild.id, user_id)
+    if name is not None:
+        return name
+    
+    if isinstance(user, disnake.Member):
+        name = user.display_name
+    else:
+        async with _member_fetch_slots:
+            try:
+                with DISCORD_SECONDS.time(method="fetch_member"):
+                    name = (await guild.fetch_member(user_id)).display_name
+            except disnake.NotFound:
+                # Пользователь не на сервере - остаётся его глобальное имя
+                try:
+                    with DISCORD_SECONDS.time(method="fetch_user"):
+                        name = (await bot.fetch_user(user_id)).display_name
+                except disnake.HTTPException:
+                    return None
+            except disnake.HTTPException:
+                return None
+    
+    display_names.put(guild.id, user_id, name)
+    return name
+
+@bot.listen("on_raw_member_update")
+async def refresh_display_name(member: disnake.Member):
+    # Приходит и без кэша участников, в отличие от on_member_update
+    display_names.refresh(member.guild.id, member.id, member.display_name)
+
+# Длина превью отката в сообщении статуса
+ROLLBACK_PREVIEW_LENGTH = 150
+DISCORD_MESSAGE_LIMIT = 2000
+EMBED_DESCRIPTION_LIMIT = 4096
+
+def build_status_messages(list_data):
+    """Формирует сообщения статуса: {0: заголовок, chunk_index: блок участников}.
+    
+    Участник закреплён за своим блоком (chunk_index), поэтому изменение или уход
+    одного участника меняет только его блок и счётчики в заголовке. Пустые блоки
+    не выводятся.
+    
+    Блок, появившийся позже остальных (список вырос или опустевший блок снова
+    заполнился), отправляется новым сообщением в конец статического канала - после
+    досок других списков. Блоки не переотправляются ради порядка: каждый подписан
+    ID списка и номером части.
+    """
+    rollbacks_by_user = list_data.rollbacks_by_user()
+    total_participants = len(list_data.participants)
+    completed_rollbacks = sum(1 for p in list_data.participants.values() if p.has_rollback)
+    
+    header = [
+        f"📊 **СТАТУС ОТКАТОВ: {list_data.name}**\n\n",
+        f"📋 ID списка: `{list_data.id}`\n",
+        f"👥 Всего участников: **{total_participants}**\n",
+        f"✅ Отправили откат: **{completed_rollbacks}** / **{total_participants}**\n",
+        f"{'='*50}\n",
+    ]
+    if not list_data.participants:
+        header.append("\n*Список участников пуст*\n")
+    messages = {0: "".join(header)}
+    
+    chunks = {}
+    for user_id, participant in list_data.participants.items():
+        parts = chunks.get(participant.chunk_index)
+        if parts is None:
+            parts = chunks[participant.chunk_index] = [f"📋 `{list_data.id}` · часть {participant.chunk_index}\n\n"]
+        
+        status = "🟢" if participant.has_rollback else "🔴"
+        parts.append(f"{status} **{participant.display_name}**\n")
+        
+        user_rollback = rollbacks_by_user.get(user_id) if participant.has_rollback else None
+        if user_rollback and user_rollback.text:
+            rollback_preview = user_rollback.text[:ROLLBACK_PREVIEW_LENGTH]
+            if len(user_rollback.text) > ROLLBACK_PREVIEW_LENGTH:
+                rollback_preview += "..."
+            parts.append(f"  └ 📝 {rollback_preview}\n")
+        parts.append("\n")
+    
+    for chunk_index in sorted(chunks):
+        messages[chunk_index] = "".join(chunks[chunk_index])[:DISCORD_MESSAGE_LIMIT]
+    
+    return messages
+
+def render_hash(payload):
+    """Хэш отрисованного содержимого сообщения"""
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+# Какие части статуса были запрошены при последней отрисовке списка: опустевшие
+# блоки удаляются, даже если их отправка ещё стоит в очереди. Запись живёт, пока
+# существует список
+_status_parts_requested = {}
+
+def send_status_part(channel, list_data, index, content):
+    """Ставит в очередь отправку или правку части статуса: 0 - заголовок, далее блоки"""
+    content_hash = render_hash(content)
+    
+    async def send_or_edit():
+        if index == 0:
+            message_id, last_hash = list_data.status_message_id, list_data.status_message_hash
+        else:
+            chunk = list_data.status_chunks.get(index)
+            message_id, last_hash = (chunk.message_id, chunk.content_hash) if chunk else (None, None)
+        
+        if message_id:
+            if last_hash == content_hash:
+                # Содержимое не изменилось - запрос к Discord не нужен
+                return
+            try:
+                # Редактируем по ID без предварительного fetch_message
+                with DISCORD_SECONDS.time(method="edit"):
+                    await channel.get_partial_message(message_id).edit(content=content)
+            except disnake.NotFound:
+                # Сообщение удалено - ниже отправим новое
+                message_id = None
+        
+        if not message_id:
+            with DISCORD_SECONDS.time(method="send"):
+                new_message = await channel.send(content)
+            message_id = new_message.id
+        
+        if index == 0:
+            list_data.status_message_id = message_id
+            list_data.status_message_hash = content_hash
+            await save_status_message(list_data)
+        else:
+            list_data.status_chunks[index] = StatusChunk(message_id, content_hash)
+            await save_status_chunk(list_data, index)
+    
+    return outbox.submit(channel.id, send_or_edit, supersede_key=("status", list_data.id, index))
+
+def delete_status_part(channel, list_data, index):
+    """Ставит в очередь удаление лишнего блока статуса"""
+    async def delete():
+        chunk = list_data.status_chunks.pop(index, None)
+        if chunk is None:
+            return
+        try:
+            with DISCORD_SECONDS.time(method="delete"):
+                await channel.get_partial_message(chunk.message_id).delete()
+        except disnake.NotFound:
+            pass
+        await delete_status_chunk(list_data, index)
+    
+    return outbox.submit(channel.id, delete, supersede_key=("status", list_data.id, index))
+
+@timed(STEP_SECONDS, step="update_status_message")
 async def update_status_message(list_data):
-    """Обновляет сообщение со статусом откатов в СТАТИЧЕСКОМ канале"""
+    """Обновляет сообщения со статусом откатов в СТАТИЧЕСКОМ канале"""
     try:
-        config = get_server_config(list_data["guild_id"])
+        config = get_server_config(list_data.guild_id)
         if not config:
             return
             
-        channel_id = config["static_channel_id"]
+        channel_id = config.static_channel_id
         channel = bot.get_channel(channel_id)
         if not channel:
             return
         
-        # Формируем содержимое сообщения
-        total_participants = len(list_data['participants'])
-        completed_rollbacks = sum(1 for p in list_data['participants'].values() if p['has_rollback'])
+        messages = build_status_messages(list_data)
         
-        message_content = f"📊 **СТАТУС ОТКАТОВ: {list_data['name']}**\n\n"
-        message_content += f"📋 ID списка: `{list_data['id']}`\n"
-        message_content += f"👥 Всего участников: **{total_participants}**\n"
-        message_content += f"✅ Отправили откат: **{completed_rollbacks}** / **{total_participants}**\n"
-        message_content += f"{'='*50}\n\n"
+        # Правятся только части, содержимое которых изменилось (см. send_status_part)
+        jobs = [send_status_part(channel, list_data, index, content) for index, content in messages.items()]
         
-        if not list_data['participants']:
-            message_content += "*Список участников пуст*\n"
-        else:
-            for user_id, participant in sorted(list_data['participants'].items(), key=lambda x: x[1]['registered_at']):
-                status = "🟢" if participant['has_rollback'] else "🔴"
-                username = participant['display_name']
-                message_content += f"{status} **{username}**\n"
-                
-                if participant['has_rollback']:
-                    user_rollback = None
-                    for rollback in list_data['rollbacks'].values():
-                        if rollback['user_id'] == user_id:
-                            user_rollback = rollback
-                            break
-                    if user_rollback:
-                        rollback_text = user_rollback['text']
-                        if rollback_text:
-                            rollback_preview = rollback_text[:150]
-                            if len(rollback_text) > 150:
-                                rollback_preview += "..."
-                            message_content += f"  └ 📝 {rollback_preview}\n"
-                message_content += "\n"
-        
-        # Проверяем, есть ли уже сообщение со статусом
-        status_message_id = list_data.get("status_message_id")
-        
-        if status_message_id:
-            try:
-                status_message = await channel.fetch_message(status_message_id)
-                await status_message.edit(content=message_content)
-                return
-            except:
-                pass
+        previous = _status_parts_requested.get(list_data.id, set()) | list_data.status_chunks.keys()
+        for index in sorted(previous - messages.keys()):
+            jobs.append(delete_status_part(channel, list_data, index))
+        _status_parts_requested[list_data.id] = set(messages)
         
-        # Создаём новое сообщение
-        new_message = await channel.send(message_content)
-        list_data["status_message_id"] = new_message.id
-        update_list_data(list_data)
+        results = await asyncio.gather(*jobs, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
         
     except Exception as e:
-        print(f"Ошибка при обновлении статуса списка {list_data['id']}: {e}")
+        print(f"Ошибка при обновлении статуса списка {list_data.id}: {e}")
 
 class CreateListModal(disnake.ui.Modal):
     def __init__(self, guild_id):
@@ -442,8 +2539,10 @@ class CreateListModal(disnake.ui.Modal):
             )
         ]
         super().__init__(title="Создание нового списка", components=components)
-
+    
+    @timed(INTERACTION_SECONDS, kind="modal", name="create_list")
     async def callback(self, inter: disnake.ModalInteraction):
+        enter_shard(self.guild_id)
         time_value = inter.text_values["time"].strip()
         date_value = inter.text_values["date"].strip()
         name_value = inter.text_values["name"].strip()
@@ -453,13 +2552,8 @@ class CreateListModal(disnake.ui.Modal):
         list_id = generate_list_id()
         
         # Проверяем уникальность ID в БД
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM lists WHERE id = ?", (list_id,))
-        while cursor.fetchone():
+        while await list_id_exists(list_id):
             list_id = generate_list_id()
-            cursor.execute("SELECT id FROM lists WHERE id = ?", (list_id,))
-        conn.close()
         
         full_name = f"{time_value} | {date_value} | {name_value} | {server_value}"
         
@@ -467,25 +2561,24 @@ class CreateListModal(disnake.ui.Modal):
         channel_id = inter.channel_id
         
         # Создаём список в БД
-        list_data = create_new_list(list_id, full_name, channel_id, str(inter.author.id), self.guild_id)
+        list_data = await create_new_list(list_id, full_name, channel_id, str(inter.author.id), self.guild_id)
         
         config = get_server_config(self.guild_id)
-        static_channel_mention = f"<#{config['static_channel_id']}>" if config else "не указан"
+        static_channel_mention = f"<#{config.static_channel_id}>" if config else "не указан"
         
-        await inter.response.send_message(
+        await reply(
+            inter,
             f"✅ Список создан!\n"
             f"ID: `{list_id}`\n"
             f"Название: {full_name}\n"
             f"Канал с кнопками: {inter.channel.mention}\n"
             f"Статус откатов: {static_channel_mention}\n\n"
             f"Для регистрации участников используйте:\n"
-            f"`/register_user list_id:{list_id} users:@участник1 @участник2`",
-            ephemeral=True
+            f"`/register_user list_id:{list_id} users:@участник1 @участник2`"
         )
         
-        # Создаем сообщения:
-        await update_participants_message(inter.channel, list_data)
-        await update_status_message(list_data)
+        # Сообщения создаст планировщик
+        schedule_render(list_data)
 
 class RollbackModal(disnake.ui.Modal):
     def __init__(self, list_id, guild_id, has_existing_rollback=False):
@@ -511,18 +2604,20 @@ class RollbackModal(disnake.ui.Modal):
         title = "Заменить откат" if has_existing_rollback else "Отправить откат"
         super().__init__(title=title, components=components)
 
+    @timed(INTERACTION_SECONDS, kind="modal", name="rollback")
     async def callback(self, inter: disnake.ModalInteraction):
-        list_data = get_list(self.list_id, self.guild_id)
+        enter_shard(self.guild_id)
+        list_data = await get_list(self.list_id, self.guild_id)
         if not list_data:
-            await inter.response.send_message("❌ Список не найден!", ephemeral=True)
+            await reply(inter, "❌ Список не найден!")
             return
             
         user_id = str(inter.author.id)
         
-        if user_id not in list_data["participants"]:
-            await inter.response.send_message(
-                "❌ Вы не зарегистрированы в этом списке! Обратитесь к администратору.",
-                ephemeral=True
+        if user_id not in list_data.participants:
+            await reply(
+                inter,
+                "❌ Вы не зарегистрированы в этом списке! Обратитесь к администратору."
             )
             return
             
@@ -532,233 +2627,477 @@ class RollbackModal(disnake.ui.Modal):
         cleaned_text = clean_rollback_text(rollback_text)
         
         if not cleaned_text:
-            await inter.response.send_message(
-                "❌ Текст отката не может быть пустым! Пожалуйста, напишите ваш откат текстом, а не только ссылками.",
-                ephemeral=True
+            await reply(
+                inter,
+                "❌ Текст отката не может быть пустым! Пожалуйста, напишите ваш откат текстом, а не только ссылками."
             )
             return
         
         # Обновляем серверный никнейм участника
         server_nickname = inter.author.display_name
         
-        # Удаляем старый откат, если он есть
-        if self.has_existing_rollback:
-            remove_user_rollback(self.list_id, user_id)
-        
-        # Добавляем новый откат
-        add_rollback(self.list_id, user_id, server_nickname, cleaned_text)
-        
-        # Обновляем данные списка
-        updated_list_data = get_list(self.list_id, self.guild_id)
+        # Новый откат заменяет старый одной транзакцией
+        rollback = await replace_rollback(self.list_id, user_id, server_nickname, cleaned_text)
+        if rollback is None:
+            await reply(
+                inter,
+                "❌ Вы не зарегистрированы в этом списке! Обратитесь к администратору."
+            )
+            return
         
         if self.has_existing_rollback:
-            message = f"✅ Ваш откат в списке '{list_data['name']}' заменен на новый! Статус обновлен."
+            message = f"✅ Ваш откат в списке '{list_data.name}' заменен на новый! Статус обновлен."
         else:
-            message = f"✅ Ваш откат отправлен в список '{list_data['name']}'! Статус обновлен."
+            message = f"✅ Ваш откат отправлен в список '{list_data.name}'! Статус обновлен."
             
-        await inter.response.send_message(message, ephemeral=True)
+        await reply(inter, message)
         
-        # Обновляем оба сообщения:
-        channel = bot.get_channel(updated_list_data["channel_id"])
-        if channel:
-            await update_participants_message(channel, updated_list_data)
-        await update_status_message(updated_list_data)
-
-class DeleteRollbackView(disnake.ui.View):
-    def __init__(self, list_id, guild_id):
-        super().__init__(timeout=60)
-        self.list_id = list_id
-        self.guild_id = guild_id
-    
-    @disnake.ui.button(label="Да, удалить мой откат", style=disnake.ButtonStyle.danger)
-    async def confirm_button(self, button: disnake.ui.Button, inter: disnake.MessageInteraction):
-        list_data = get_list(self.list_id, self.guild_id)
-        if not list_data:
-            await inter.response.send_message("❌ Список не найден!", ephemeral=True)
-            return
-            
-        user_id = str(inter.author.id)
-        
-        if user_id not in list_data["participants"]:
-            await inter.response.send_message("❌ Вы не зарегистрированы в этом списке!", ephemeral=True)
-            return
-            
-        if not list_data["participants"][user_id]["has_rollback"]:
-            await inter.response.send_message("❌ У вас нет отправленного отката!", ephemeral=True)
-            return
-        
-        # Удаляем откат
-        if remove_user_rollback(self.list_id, user_id):
-            updated_list_data = get_list(self.list_id, self.guild_id)
-            
-            await inter.response.send_message(
-                f"✅ Ваш откат удален из списка '{list_data['name']}'!", 
-                ephemeral=True
-            )
-            
-            # Обновляем сообщения
-            channel = bot.get_channel(updated_list_data["channel_id"])
-            if channel:
-                await update_participants_message(channel, updated_list_data)
-            await update_status_message(updated_list_data)
-        else:
-            await inter.response.send_message("❌ Не удалось удалить откат!", ephemeral=True)
-        
-        # Удаляем кнопки после использования
-        await inter.message.delete()
-    
-    @disnake.ui.button(label="Отмена", style=disnake.ButtonStyle.secondary)
-    async def cancel_button(self, button: disnake.ui.Button, inter: disnake.MessageInteraction):
-        await inter.response.send_message("❌ Удаление отката отменено.", ephemeral=True)
-        await inter.message.delete()
+        # Сообщения перерисует планировщик
+        schedule_render(list_data)
 
+@timed(STEP_SECONDS, step="update_participants_message")
 async def update_participants_message(channel, list_data):
     """Обновляет сообщение со списком участников и кнопками в канале списка"""
     if not list_data:
         return
     
-    if list_data.get("message_id"):
-        try:
-            message = await channel.fetch_message(list_data["message_id"])
-            embed = disnake.Embed(
-                title=f"📋 {list_data['name']}",
-                description=await generate_participants_list(list_data),
-                color=0x2b2d31
-            )
-            embed.set_footer(text=f"ID: {list_data['id']} | Регистрация через администратора")
-            
-            # Создаем новое View каждый раз
-            view = MainView(list_data["id"], list_data["guild_id"])
-            await message.edit(embed=embed, view=view)
-            return
-        except:
-            pass
-    
-    # Создаём новое сообщение
     embed = disnake.Embed(
-        title=f"📋 {list_data['name']}",
+        title=f"📋 {list_data.name}",
         description=await generate_participants_list(list_data),
         color=0x2b2d31
     )
-    embed.set_footer(text=f"ID: {list_data['id']} | Регистрация через администратора")
-    
-    # Создаем новое View
-    view = MainView(list_data["id"], list_data["guild_id"])
-    message = await channel.send(embed=embed, view=view)
+    embed.set_footer(text=f"ID: {list_data.id} | Регистрация через администратора")
+    components = list_components(list_data.id)
+    content_hash = render_hash(json.dumps({
+        "embed": embed.to_dict(),
+        "components": [component.to_component_dict() for component in components],
+    }, sort_keys=True, ensure_ascii=False))
+    
+    async def send_or_edit():
+        if list_data.message_id and list_data.message_hash == content_hash:
+            # Содержимое не изменилось - запрос к Discord не нужен
+            return
+        
+        if list_data.message_id:
+            try:
+                # Редактируем по ID без предварительного fetch_message
+                with DISCORD_SECONDS.time(method="edit"):
+                    await channel.get_partial_message(list_data.message_id).edit(embed=embed, components=components)
+                list_data.message_hash = content_hash
+                await save_participants_message(list_data)
+                return
+            except disnake.NotFound:
+                # Сообщение удалено - ниже отправим новое
+                pass
+        
+        # Создаём новое сообщение
+        with DISCORD_SECONDS.time(method="send"):
+            message = await channel.send(embed=embed, components=components)
+        
+        # Обновляем message_id в БД
+        list_data.message_id = message.id
+        list_data.message_hash = content_hash
+        await save_participants_message(list_data)
     
-    # Обновляем message_id в БД
-    list_data["message_id"] = message.id
-    update_list_data(list_data)
+    await outbox.submit(channel.id, send_or_edit, supersede_key=("participants", list_data.id))
+
+def _participants_overflow_line(count):
+    return f"…и ещё {count}, полный статус - в канале статуса"
 
 async def generate_participants_list(list_data):
-    if not list_data or not list_data["participants"]:
+    """Описание embed со списком участников.
+    
+    Строка участника занимает ~25 символов, так что после ~160 участников
+    описание упирается в лимит Discord: остаток заменяется строкой «…и ещё N»,
+    полный статус по блокам есть в статическом канале.
+    """
+    if not list_data or not list_data.participants:
         return "*Список участников пуст*"
     
-    participants = list_data["participants"]
-    sorted_participants = sorted(
-        participants.items(), 
-        key=lambda x: x[1]["registered_at"]
-    )
+    total = len(list_data.participants)
+    # Место под строку «…и ещё N» с переводом строки перед ней
+    limit = EMBED_DESCRIPTION_LIMIT - len(_participants_overflow_line(total)) - 1
     
+    # Участники уже упорядочены по времени регистрации
     lines = []
-    for user_id, info in sorted_participants:
-        status = "✅" if info["has_rollback"] else "❌"
+    length = -1
+    for position, (user_id, info) in enumerate(list_data.participants.items()):
+        status = "✅" if info.has_rollback else "❌"
         mention = f"<@{user_id}>"
-        lines.append(f"{status} {mention}")
+        line = f"{status} {mention}"
+        length += len(line) + 1
+        if length > limit and position < total - 1:
+            lines.append(_participants_overflow_line(total - position))
+            break
+        lines.append(line)
     
     return "\n".join(lines)
 
-class MainView(disnake.ui.View):
-    def __init__(self, list_id, guild_id):
-        super().__init__(timeout=None)
-        self.list_id = list_id
-        self.guild_id = guild_id
-    
-    @disnake.ui.button(label="Отправить откат", style=disnake.ButtonStyle.primary)
-    async def rollback_button(self, button: disnake.ui.Button, inter: disnake.MessageInteraction):
-        list_data = get_list(self.list_id, self.guild_id)
-        if not list_data:
-            await inter.response.send_message("❌ Список не найден!", ephemeral=True)
+# Кнопки без состояния: ID списка зашит в custom_id, а нажатия разбирает один
+# постоянный обработчик on_button_click, поэтому кнопки работают и после перезапуска
+BUTTON_PREFIX = "rb"
+_button_handlers = {}
+
+def button_id(action, arg):
+    return f"{BUTTON_PREFIX}:{action}:{arg}"
+
+def button_handler(action):
+    """Регистрирует обработчик кнопок с действием action"""
+    def decorator(func):
+        _button_handlers[action] = func
+        return func
+    return decorator
+
+def list_components(list_id):
+    """Кнопки под сообщением списка"""
+    return [
+        disnake.ui.Button(label="Отправить откат", style=disnake.ButtonStyle.primary, custom_id=button_id("submit", list_id)),
+        disnake.ui.Button(label="Обновить список", style=disnake.ButtonStyle.secondary, custom_id=button_id("refresh", list_id)),
+    ]
+
+# Доски, отрисованные до кнопок вида rb:<действие>:<аргумент>, несут кнопки
+# MainView со случайными custom_id. Их действие узнаётся по надписи, список - по
+# сообщению, а сама доска перерисовывается уже с новыми кнопками
+LEGACY_BUTTON_ACTIONS = {"Отправить откат": "submit", "Обновить список": "refresh"}
+
+@bot.listen("on_button_click")
+async def dispatch_button_click(inter: disnake.MessageInteraction):
+    prefix, _, rest = inter.component.custom_id.partition(":")
+    if prefix == BUTTON_PREFIX:
+        action, _, arg = rest.partition(":")
+    else:
+        action = LEGACY_BUTTON_ACTIONS.get(inter.component.label)
+        if action is None:
             return
-            
-        user_id = str(inter.author.id)
-        if user_id not in list_data["participants"]:
-            await inter.response.send_message(
-                "❌ Вы не зарегистрированы в этом списке! Обратитесь к администратору.",
-                ephemeral=True
-            )
+        enter_shard(inter.guild_id)
+        arg = await find_list_by_message(inter.guild_id, inter.message.id)
+        if arg is None:
             return
+        mark_list_dirty(arg, inter.guild_id)
+    
+    handler = _button_handlers.get(action)
+    if handler:
+        enter_shard(inter.guild_id)
+        with INTERACTION_SECONDS.time(kind="button", name=action):
+            await handler(inter, arg)
+
+@button_handler("submit")
+async def rollback_button(inter: disnake.MessageInteraction, list_id):
+    list_data = await get_list(list_id, inter.guild_id)
+    if not list_data:
+        await reply(inter, "❌ Список не найден!")
+        return
         
-        # Проверяем, есть ли уже откат у пользователя
-        has_existing_rollback = list_data["participants"][user_id]["has_rollback"]
+    user_id = str(inter.author.id)
+    if user_id not in list_data.participants:
+        await reply(
+            inter,
+            "❌ Вы не зарегистрированы в этом списке! Обратитесь к администратору."
+        )
+        return
+    
+    # Проверяем, есть ли уже откат у пользователя
+    has_existing_rollback = list_data.participants[user_id].has_rollback
+    
+    if has_existing_rollback:
+        await reply(
+            inter,
+            "📝 У вас уже есть отправленный откат. Что вы хотите сделать?",
+            components=[
+                disnake.ui.Button(label="Заменить откат", style=disnake.ButtonStyle.primary, custom_id=button_id("replace", list_id)),
+                disnake.ui.Button(label="Удалить откат", style=disnake.ButtonStyle.danger, custom_id=button_id("delete", list_id)),
+                disnake.ui.Button(label="Отмена", style=disnake.ButtonStyle.secondary, custom_id=button_id("cancel", list_id)),
+            ]
+        )
+    else:
+        # Если отката нет, просто отправляем модальное окно
+        await inter.response.send_modal(RollbackModal(list_id, inter.guild_id, has_existing_rollback=False))
+
+@button_handler("replace")
+async def replace_rollback_button(inter: disnake.MessageInteraction, list_id):
+    await inter.response.send_modal(RollbackModal(list_id, inter.guild_id, has_existing_rollback=True))
+
+@button_handler("delete")
+async def delete_rollback_button(inter: disnake.MessageInteraction, list_id):
+    await reply(
+        inter,
+        "❓ Вы уверены, что хотите удалить свой откат?",
+        components=[
+            disnake.ui.Button(label="Да, удалить мой откат", style=disnake.ButtonStyle.danger, custom_id=button_id("confirm_delete", list_id)),
+            disnake.ui.Button(label="Отмена", style=disnake.ButtonStyle.secondary, custom_id=button_id("cancel_delete", list_id)),
+        ]
+    )
+
+@button_handler("cancel")
+async def cancel_choice_button(inter: disnake.MessageInteraction, list_id):
+    await replace_reply(inter, "❌ Действие отменено.", components=[])
+
+@button_handler("confirm_delete")
+async def confirm_delete_button(inter: disnake.MessageInteraction, list_id):
+    list_data = await get_list(list_id, inter.guild_id)
+    if not list_data:
+        await replace_reply(inter, "❌ Список не найден!", components=[])
+        return
         
-        if has_existing_rollback:
-            # Создаем отдельный класс для кнопок выбора
-            class ChoiceView(disnake.ui.View):
-                def __init__(self, list_id, guild_id):
-                    super().__init__(timeout=60)
-                    self.list_id = list_id
-                    self.guild_id = guild_id
-                
-                @disnake.ui.button(label="Заменить откат", style=disnake.ButtonStyle.primary)
-                async def replace_button(self, button: disnake.ui.Button, interaction: disnake.MessageInteraction):
-                    await interaction.response.send_modal(RollbackModal(self.list_id, self.guild_id, has_existing_rollback=True))
-                
-                @disnake.ui.button(label="Удалить откат", style=disnake.ButtonStyle.danger)
-                async def delete_button(self, button: disnake.ui.Button, interaction: disnake.MessageInteraction):
-                    delete_view = DeleteRollbackView(self.list_id, self.guild_id)
-                    await interaction.response.send_message(
-                        "❓ Вы уверены, что хотите удалить свой откат?",
-                        view=delete_view,
-                        ephemeral=True
-                    )
-                
-                @disnake.ui.button(label="Отмена", style=disnake.ButtonStyle.secondary)
-                async def cancel_button(self, button: disnake.ui.Button, interaction: disnake.MessageInteraction):
-                    await interaction.response.send_message("❌ Действие отменено.", ephemeral=True)
+    user_id = str(inter.author.id)
+    
+    if user_id not in list_data.participants:
+        await replace_reply(inter, "❌ Вы не зарегистрированы в этом списке!", components=[])
+        return
+        
+    if not list_data.participants[user_id].has_rollback:
+        await replace_reply(inter, "❌ У вас нет отправленного отката!", components=[])
+        return
+    
+    # Удаляем откат; кнопки подтверждения убираются вместе с ответом
+    if await remove_user_rollback(list_id, user_id):
+        await replace_reply(inter, f"✅ Ваш откат удален из списка '{list_data.name}'!", components=[])
+        
+        # Сообщения перерисует планировщик
+        schedule_render(list_data)
+    else:
+        # Откат уже удалён параллельным запросом
+        await replace_reply(inter, "❌ У вас нет отправленного отката!", components=[])
+
+@button_handler("cancel_delete")
+async def cancel_delete_button(inter: disnake.MessageInteraction, list_id):
+    await replace_reply(inter, "❌ Удаление отката отменено.", components=[])
+
+@button_handler("refresh")
+async def refresh_button(inter: disnake.MessageInteraction, list_id):
+    list_data = await get_list(list_id, inter.guild_id)
+    if not list_data:
+        await reply(inter, "❌ Список не найден!")
+        return
+        
+    # Сообщения перерисует планировщик
+    schedule_render(list_data)
+    await reply(inter, "✅ Оба списка будут обновлены в течение нескольких секунд!")
+
+# Планировщик перерисовки: мутации только помечают список «грязным»,
+# а сообщения перерисовываются не чаще одного раза за окно
+RENDER_WINDOW_SECONDS = float(os.getenv("RENDER_WINDOW_SECONDS", "2"))
+_dirty_lists = {}
+
+def owns_guild(guild_id):
+    """Перерисовывает ли этот процесс списки сервера: да, если он подключил шард сервера"""
+    if SHARD_IDS:
+        return shard_for_guild(guild_id) in SHARD_IDS
+    return True
+
+def schedule_render(list_data):
+    """Помечает список для перерисовки в ближайшем окне"""
+    mark_list_dirty(list_data.id, list_data.guild_id)
+
+def mark_list_dirty(list_id, guild_id):
+    # Чужие списки перерисует владелец: он узнает об изменении из ленты изменений
+    if not owns_guild(guild_id):
+        return
+    _dirty_lists[list_id] = guild_id
+    if not render_dirty_lists.is_running():
+        render_dirty_lists.start()
+
+@timed(STEP_SECONDS, step="render_list")
+async def render_list(list_id, guild_id):
+    """Перерисовывает оба сообщения списка по актуальному состоянию"""
+    enter_shard(guild_id)
+    try:
+        async with shard_render_slots(guild_id):
+            list_data = await get_list(list_id, guild_id)
+            if not list_data:
+                return
             
-            choice_view = ChoiceView(self.list_id, self.guild_id)
+            renders = [update_status_message(list_data)]
+            channel = bot.get_channel(list_data.channel_id)
+            if channel:
+                renders.append(update_participants_message(channel, list_data))
+            await asyncio.gather(*renders)
+    except Exception as e:
+        print(f"Ошибка при перерисовке списка {list_id}: {e}")
+
+_render_tasks = set()
+
+@tasks.loop(seconds=RENDER_WINDOW_SECONDS)
+async def render_dirty_lists():
+    if not _dirty_lists:
+        return
+    
+    dirty = list(_dirty_lists.items())
+    _dirty_lists.clear()
+    
+    # Не ждём завершения: запросы к Discord выполняет очередь, а устаревшие
+    # отрисовки вытесняются следующими окнами
+    for list_id, guild_id in dirty:
+        task = asyncio.create_task(render_list(list_id, guild_id))
+        _render_tasks.add(task)
+        task.add_done_callback(_render_tasks.discard)
+
+class ChangeFeed:
+    """Изменения списков, сделанные другими процессами бота.
+    
+    Каждое изменение сбрасывает список в кэше, а процесс-владелец сервера
+    ставит список в очередь перерисовки. Слушатель - отдельное соединение,
+    сокет которого опрашивает цикл событий. Пока подписки нет, уведомления
+    теряются, поэтому после каждого подключения кэши сбрасываются целиком.
+    """
+    
+    def __init__(self):
+        self._task = None
+        self.connected = False
+        self.received = 0
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                listener = await run_db(storage.open_change_listener)
+            except Exception as e:
+                print(f"Ошибка подписки на изменения списков: {e}")
+                await asyncio.sleep(CHANGE_FEED_RECONNECT_SECONDS)
+                continue
+            if listener is None:
+                return
             
-            await inter.response.send_message(
-                "📝 У вас уже есть отправленный откат. Что вы хотите сделать?",
-                view=choice_view,
-                ephemeral=True
-            )
-        else:
-            # Если отката нет, просто отправляем модальное окно
-            await inter.response.send_modal(RollbackModal(self.list_id, self.guild_id, has_existing_rollback=False))
+            list_cache.clear()
+            list_index.clear()
+            self.connected = True
+            lost = loop.create_future()
+            # После обрыва psycopg2 закрывает соединение и fileno() бросает
+            # исключение, поэтому дескриптор запоминается заранее
+            fd = listener.fileno()
+            loop.add_reader(fd, self._on_readable, listener, lost)
+            print(f"📡 Подписка на изменения списков активна ({INSTANCE_ID})")
+            try:
+                await lost
+            except Exception as e:
+                print(f"Подписка на изменения списков потеряна: {e}")
+            finally:
+                self.connected = False
+                loop.remove_reader(fd)
+                try:
+                    listener.close()
+                except Exception as e:
+                    print(f"Ошибка при закрытии подписки на изменения списков: {e}")
+            await asyncio.sleep(CHANGE_FEED_RECONNECT_SECONDS)
+    
+    def _on_readable(self, listener, lost):
+        if lost.done():
+            return
+        try:
+            payloads = listener.drain()
+        except Exception as e:
+            lost.set_exception(e)
+            return
+        for payload in payloads:
+            self._apply(json.loads(payload))
     
-    @disnake.ui.button(label="Обновить список", style=disnake.ButtonStyle.secondary)
-    async def refresh_button(self, button: disnake.ui.Button, inter: disnake.MessageInteraction):
-        await inter.response.defer(ephemeral=True)
-        list_data = get_list(self.list_id, self.guild_id)
-        if not list_data:
-            await inter.followup.send("❌ Список не найден!", ephemeral=True)
+    def _apply(self, change):
+        if change["origin"] == INSTANCE_ID:
+            # Свои изменения уже применены к кэшу при записи
             return
-            
-        # Обновляем оба сообщения:
-        channel = bot.get_channel(list_data["channel_id"])
-        if channel:
-            await update_participants_message(channel, list_data)
-        await update_status_message(list_data)
-        await inter.edit_original_response(content="✅ Оба списка обновлены!")
+        self.received += 1
+        if change["kind"] == "config":
+            task = asyncio.create_task(reload_guild_configs())
+            task.add_done_callback(_report_config_reload)
+            return
+        list_id, guild_id, kind = change["list_id"], change["guild_id"], change["kind"]
+        
+        list_cache.invalidate(list_id)
+        if kind == "deleted":
+            list_index.remove(guild_id, list_id)
+            _dirty_lists.pop(list_id, None)
+            _status_parts_requested.pop(list_id, None)
+            return
+        if kind == "created":
+            list_index.invalidate(guild_id)
+        # "messages" - это записи самой перерисовки, после них перерисовывать нечего
+        if kind in ("created", "data"):
+            mark_list_dirty(list_id, guild_id)
+
+def _report_config_reload(task):
+    if task.cancelled():
+        return
+    if task.exception():
+        print(f"Ошибка при перезагрузке настроек серверов: {task.exception()}")
+    else:
+        print(f"🔄 Настройки серверов перечитаны по запросу другого процесса: {task.result()}")
+
+change_feed = ChangeFeed()
+
+def print_shard_summary():
+    """Серверы и участники по шардам этого процесса"""
+    guilds = {shard_id: 0 for shard_id in bot.shards}
+    members = dict.fromkeys(bot.shards, 0)
+    for guild in bot.guilds:
+        guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+        members[guild.shard_id] = members.get(guild.shard_id, 0) + (guild.member_count or 0)
+    print(f"Шарды процесса: {len(bot.shards)} из {bot.shard_count}")
+    for shard_id in sorted(guilds):
+        print(f"- Шард {shard_id}: серверов {guilds[shard_id]}, участников {members[shard_id]}")
+
+@bot.event
+async def on_shard_ready(shard_id):
+    print(f"Шард {shard_id} подключён")
 
 @bot.event
 async def on_ready():
     print(f'Bot {bot.user} готов к работе!')
     print(f'Подключен к {len(bot.guilds)} серверам')
     print("Поддерживаемые серверы:")
-    for guild_id, config in SERVER_CONFIGS.items():
+    for guild_id in guild_configs:
         print(f"- Сервер {guild_id}")
-    
-    # Инициализируем БД
-    init_db()
+    if SHARD_COUNT:
+        print_shard_summary()
+    if INSTANCE_COUNT > 1:
+        print(f"Процесс {INSTANCE_ID}: {INSTANCE_INDEX + 1} из {INSTANCE_COUNT}, "
+              f"перерисовывает {sum(owns_guild(guild.id) for guild in bot.guilds)} серверов")
+    
+    # БД инициализируется один раз при запуске (см. __main__): on_ready
+    # срабатывает заново при каждом переподключении к шлюзу
+    if not render_dirty_lists.is_running():
+        render_dirty_lists.start()
+    change_feed.start()
+    await start_metrics_server()
+    if LOW_MEMORY_MODE:
+        print("🪶 Экономный режим памяти: участники серверов не кэшируются")
     print("✅ Бот запущен и готов к работе!")
 
+# Время начала обработки слеш-команд по ID взаимодействия
+_slash_started = {}
+
+@bot.before_slash_command_invoke
+async def before_slash_command(inter: disnake.ApplicationCommandInteraction):
+    _slash_started[inter.id] = time.perf_counter()
+    enter_shard(inter.guild_id)
+
+@bot.after_slash_command_invoke
+async def after_slash_command(inter: disnake.ApplicationCommandInteraction):
+    started = _slash_started.pop(inter.id, None)
+    if started is not None:
+        INTERACTION_SECONDS.observe(
+            time.perf_counter() - started, kind="slash", name=inter.application_command.qualified_name
+        )
+
+async def autocomplete_list_id(inter: disnake.ApplicationCommandInteraction, user_input: str):
+    """Подсказки для list_id из индекса в памяти: у ответа автодополнения жёсткий срок"""
+    if inter.guild_id is None:
+        return {}
+    enter_shard(inter.guild_id)
+    await list_index.ensure_loaded(inter.guild_id)
+    # ID в начале подписи делает её уникальной даже после обрезки названия
+    return {
+        f"{list_id} | {name}"[:AUTOCOMPLETE_CHOICE_LENGTH]: list_id
+        for list_id, name in list_index.search(inter.guild_id, user_input)
+    }
+
 @bot.slash_command(description="Создать новый список откатов")
 async def create_list(inter: disnake.ApplicationCommandInteraction):
     if not is_admin(inter.author):
-        await inter.response.send_message("❌ У вас нет прав для выполнения этой команды!", ephemeral=True)
+        await reply(inter, "❌ У вас нет прав для выполнения этой команды!")
         return
     
     await inter.response.send_modal(CreateListModal(inter.guild.id))
@@ -766,203 +3105,312 @@ async def create_list(inter: disnake.ApplicationCommandInteraction):
 @bot.slash_command(description="Регистрировать пользователей в списке")
 async def register_user(
     inter: disnake.ApplicationCommandInteraction,
-    list_id: str = commands.Param(description="ID списка"),
+    list_id: str = commands.Param(description="ID списка", autocomplete=autocomplete_list_id),
     users: str = commands.Param(description="Пользователи через @ или ID через пробел")
 ):
     if not is_admin(inter.author):
-        await inter.response.send_message("❌ У вас нет прав для выполнения этой команды!", ephemeral=True)
+        await reply(inter, "❌ У вас нет прав для выполнения этой команды!")
         return
     
-    list_data = get_list(list_id, inter.guild.id)
+    list_data = await get_list(list_id, inter.guild.id)
     if not list_data:
-        await inter.response.send_message("❌ Список с таким ID не найден!", ephemeral=True)
+        await reply(inter, "❌ Список с таким ID не найден!")
         return
     
     # Парсинг пользователей из строки
     user_mentions = re.findall(r'<@!?(\d+)>', users)
     user_ids = re.findall(r'\b(\d{17,19})\b', users)
     
-    all_user_ids = list(set(user_mentions + user_ids))
+    # Без повторов, в порядке упоминания
+    all_user_ids = list(dict.fromkeys(user_mentions + user_ids))
     
     if not all_user_ids:
-        await inter.response.send_message("❌ Не найдено ни одного валидного пользователя!", ephemeral=True)
+        await reply(inter, "❌ Не найдено ни одного валидного пользователя!")
         return
     
-    registered_users = []
-    already_registered = []
+    # Получение участников и запись в БД могут занять больше 3 секунд
+    await inter.response.defer(ephemeral=True)
     
-    for user_id in all_user_ids:
-        try:
-            member = inter.guild.get_member(int(user_id))
-            if not member:
-                member = await bot.fetch_user(int(user_id))
-            
-            server_nickname = member.display_name
-            
-            if not register_participant(list_id, user_id, server_nickname):
-                already_registered.append(server_nickname)
-            else:
-                registered_users.append(server_nickname)
-        except:
-            continue
-    
-    if registered_users or already_registered:
-        # Обновляем данные списка
-        updated_list_data = get_list(list_id, inter.guild.id)
-        
-        response = []
-        if registered_users:
-            response.append(f"✅ Зарегистрированы: {', '.join(registered_users)}")
-        if already_registered:
-            response.append(f"ℹ️ Уже были зарегистрированы: {', '.join(already_registered)}")
-        
-        await inter.response.send_message("\n".join(response), ephemeral=True)
-        
-        # Обновляем оба сообщения:
-        channel = bot.get_channel(updated_list_data["channel_id"])
-        if channel:
-            await update_participants_message(channel, updated_list_data)
-        await update_status_message(updated_list_data)
-    else:
-        await inter.response.send_message("❌ Не удалось зарегистрировать ни одного пользователя!", ephemeral=True)
+    async def resolve(user_id):
+        name = await resolve_display_name(inter.guild, int(user_id))
+        return (user_id, name) if name is not None else None
+    
+    # Ответ уже отложен: без edit_reply пользователь так и увидит «думает...»
+    try:
+        resolved = [entry for entry in await asyncio.gather(*(resolve(user_id) for user_id in all_user_ids)) if entry]
+        if not resolved:
+            await edit_reply(inter, "❌ Не удалось зарегистрировать ни одного пользователя!")
+            return
+        
+        registered_ids = await register_participants(list_id, resolved)
+    except Exception as e:
+        print(f"Ошибка при регистрации в списке {list_id}: {e}")
+        await edit_reply(inter, "❌ Ошибка при регистрации пользователей, попробуйте ещё раз!")
+        return
+    
+    if registered_ids is None:
+        await edit_reply(inter, "❌ Список был удалён!")
+        return
+    
+    registered_users = [name for user_id, name in resolved if user_id in registered_ids]
+    already_registered = [name for user_id, name in resolved if user_id not in registered_ids]
+    
+    response = []
+    if registered_users:
+        response.append(f"✅ Зарегистрированы: {', '.join(registered_users)}")
+    if already_registered:
+        response.append(f"ℹ️ Уже были зарегистрированы: {', '.join(already_registered)}")
+    
+    await edit_reply(inter, "\n".join(response))
+    
+    if registered_users:
+        # Сообщения перерисует планировщик
+        schedule_render(list_data)
 
 @bot.slash_command(description="Показать список откатов")
 async def show_list(
     inter: disnake.ApplicationCommandInteraction,
-    list_id: str = commands.Param(description="ID списка")
+    list_id: str = commands.Param(description="ID списка", autocomplete=autocomplete_list_id)
 ):
-    list_data = get_list(list_id, inter.guild.id)
+    list_data = await get_list(list_id, inter.guild.id)
     if not list_data:
-        await inter.response.send_message("❌ Список с таким ID не найден!", ephemeral=True)
+        await reply(inter, "❌ Список с таким ID не найден!")
         return
     
     await inter.response.defer()
     
     # Создаем временное сообщение в текущем канале
     embed = disnake.Embed(
-        title=f"📋 {list_data['name']}",
+        title=f"📋 {list_data.name}",
         description=await generate_participants_list(list_data),
         color=0x2b2d31
     )
-    embed.set_footer(text=f"ID: {list_data['id']} | Регистрация через администратора")
+    embed.set_footer(text=f"ID: {list_data.id} | Регистрация через администратора")
     
     await inter.edit_original_response(
-        content=f"✅ Список '{list_data['name']}' отображен!",
+        content=f"✅ Список '{list_data.name}' отображен!",
         embed=embed,
-        view=MainView(list_data["id"], inter.guild.id)
+        components=list_components(list_data.id)
     )
 
 @bot.slash_command(description="Удалить пользователя из списка")
 async def remove_user(
     inter: disnake.ApplicationCommandInteraction,
-    list_id: str = commands.Param(description="ID списка"),
+    list_id: str = commands.Param(description="ID списка", autocomplete=autocomplete_list_id),
     user: disnake.User = commands.Param(description="Пользователь для удаления")
 ):
     if not is_admin(inter.author):
-        await inter.response.send_message("❌ У вас нет прав для выполнения этой команды!", ephemeral=True)
+        await reply(inter, "❌ У вас нет прав для выполнения этой команды!")
         return
     
-    list_data = get_list(list_id, inter.guild.id)
+    list_data = await get_list(list_id, inter.guild.id)
     if not list_data:
-        await inter.response.send_message("❌ Список с таким ID не найден!", ephemeral=True)
+        await reply(inter, "❌ Список с таким ID не найден!")
         return
     
     user_id = str(user.id)
-    if user_id not in list_data["participants"]:
-        await inter.response.send_message("❌ Пользователь не зарегистрирован в этом списке!", ephemeral=True)
+    if user_id not in list_data.participants:
+        await reply(inter, "❌ Пользователь не зарегистрирован в этом списке!")
         return
     
     # Получаем серверный никнейм
-    member = inter.guild.get_member(user.id)
-    server_nickname = member.display_name if member else user.display_name
+    server_nickname = await resolve_display_name(inter.guild, user.id, user) or user.display_name
     
     # Удаляем пользователя из БД
-    remove_participant(list_id, user_id)
-    
-    # Обновляем данные списка
-    updated_list_data = get_list(list_id, inter.guild.id)
+    if not await remove_participant(list_id, user_id):
+        await reply(inter, "❌ Пользователь не зарегистрирован в этом списке!")
+        return
     
-    await inter.response.send_message(f"✅ Пользователь {server_nickname} удален из списка '{list_data['name']}'!", ephemeral=True)
+    await reply(inter, f"✅ Пользователь {server_nickname} удален из списка '{list_data.name}'!")
     
-    # Обновляем оба сообщения:
-    channel = bot.get_channel(updated_list_data["channel_id"])
-    if channel:
-        await update_participants_message(channel, updated_list_data)
-    await update_status_message(updated_list_data)
+    # Сообщения перерисует планировщик
+    schedule_render(list_data)
 
 @bot.slash_command(description="Удалить весь список")
 async def delete_list(
     inter: disnake.ApplicationCommandInteraction,
-    list_id: str = commands.Param(description="ID списка для удаления")
+    list_id: str = commands.Param(description="ID списка для удаления", autocomplete=autocomplete_list_id)
 ):
     if not is_admin(inter.author):
-        await inter.response.send_message("❌ У вас нет прав для выполнения этой команды!", ephemeral=True)
+        await reply(inter, "❌ У вас нет прав для выполнения этой команды!")
         return
     
-    list_data = get_list(list_id, inter.guild.id)
+    list_data = await get_list(list_id, inter.guild.id)
     if not list_data:
-        await inter.response.send_message("❌ Список с таким ID не найден!", ephemeral=True)
+        await reply(inter, "❌ Список с таким ID не найден!")
         return
     
     # Удаляем список из БД (используем переименованную функцию)
-    delete_list_from_db(list_id)
+    await delete_list_from_db(list_id, inter.guild.id)
     
-    await inter.response.send_message(f"✅ Список '{list_data['name']}' (ID: {list_id}) полностью удален!", ephemeral=True)
+    await reply(inter, f"✅ Список '{list_data.name}' (ID: {list_id}) полностью удален!")
 
 @bot.slash_command(description="Сбросить откаты всех участников")
 async def reset_rollbacks(
     inter: disnake.ApplicationCommandInteraction,
-    list_id: str = commands.Param(description="ID списка")
+    list_id: str = commands.Param(description="ID списка", autocomplete=autocomplete_list_id)
 ):
     if not is_admin(inter.author):
-        await inter.response.send_message("❌ У вас нет прав для выполнения этой команды!", ephemeral=True)
+        await reply(inter, "❌ У вас нет прав для выполнения этой команды!")
         return
     
-    list_data = get_list(list_id, inter.guild.id)
+    list_data = await get_list(list_id, inter.guild.id)
     if not list_data:
-        await inter.response.send_message("❌ Список с таким ID не найден!", ephemeral=True)
+        await reply(inter, "❌ Список с таким ID не найден!")
         return
     
     # Сбрасываем откаты в БД
-    reset_list_rollbacks(list_id)
-    
-    # Обновляем данные списка
-    updated_list_data = get_list(list_id, inter.guild.id)
+    await reset_list_rollbacks(list_id)
     
-    await inter.response.send_message(f"✅ Все откаты в списке '{list_data['name']}' сброшены!", ephemeral=True)
+    await reply(inter, f"✅ Все откаты в списке '{list_data.name}' сброшены!")
     
-    # Обновляем оба сообщения:
-    channel = bot.get_channel(updated_list_data["channel_id"])
-    if channel:
-        await update_participants_message(channel, updated_list_data)
-    await update_status_message(updated_list_data)
+    # Сообщения перерисует планировщик
+    schedule_render(list_data)
 
-@bot.slash_command(description="Посмотреть все списки")
-async def list_all(inter: disnake.ApplicationCommandInteraction):
+@bot.slash_command(description="Перечитать настройки серверов из базы")
+async def reload_config(inter: disnake.ApplicationCommandInteraction):
     if not is_admin(inter.author):
-        await inter.response.send_message("❌ У вас нет прав для выполнения этой команды!", ephemeral=True)
+        await reply(inter, "❌ У вас нет прав для выполнения этой команды!")
         return
     
-    lists_data = get_all_lists(inter.guild.id)
+    count = await reload_guild_configs()
+    # Остальные процессы бота перечитают настройки по ленте изменений
+    await run_db(storage.publish_config_change)
     
-    if not lists_data:
-        await inter.response.send_message("📋 Списков пока нет!", ephemeral=True)
+    config = get_server_config(inter.guild.id)
+    if not config:
+        await reply(inter, f"⚠️ Настройки перечитаны (серверов: {count}), но этого сервера в них больше нет")
         return
     
+    await reply(
+        inter,
+        f"✅ Настройки перечитаны, серверов: {count}\n"
+        f"Статус откатов: <#{config.static_channel_id}>\n"
+        f"Ролей администраторов: {len(config.admin_role_ids)}, пользователей: {len(config.admin_user_ids)}"
+    )
+
+async def build_lists_page(guild_id, page):
+    """Собирает embed одной страницы /list_all; возвращает embed и число страниц"""
+    lists_data, total = await get_all_lists(guild_id, page)
+    total_pages = max(1, -(-total // LISTS_PAGE_SIZE))
+    
     embed = disnake.Embed(title="📋 Все списки", color=0x2b2d31)
     
     for list_data in lists_data:
         embed.add_field(
-            name=f"{list_data['name']} (ID: {list_data['id']})",
-            value=f"Участников: {list_data['participants_count']}\nОткатов: {list_data['rollbacks_count']}",
+            name=f"{list_data.name} (ID: {list_data.id})",
+            value=f"Участников: {list_data.participants_count}\nОткатов: {list_data.rollbacks_count}",
             inline=True
         )
     
-    await inter.response.send_message(embed=embed, ephemeral=True)
+    embed.set_footer(text=f"Страница {page + 1} из {total_pages} | Всего списков: {total}")
+    return embed, total, total_pages
+
+def lists_page_components(page, total_pages):
+    """Кнопки листания /list_all; номер целевой страницы зашит в custom_id"""
+    return [
+        disnake.ui.Button(label="◀ Назад", style=disnake.ButtonStyle.secondary,
+                          custom_id=button_id("page", page - 1), disabled=page <= 0),
+        disnake.ui.Button(label="Вперёд ▶", style=disnake.ButtonStyle.secondary,
+                          custom_id=button_id("page", page + 1), disabled=page >= total_pages - 1),
+    ]
+
+@button_handler("page")
+async def lists_page_button(inter: disnake.MessageInteraction, page):
+    # Каждая страница запрашивается из БД только при переходе
+    page = max(0, int(page))
+    embed, _, total_pages = await build_lists_page(inter.guild_id, page)
+    await replace_reply(inter, embed=embed, components=lists_page_components(page, total_pages))
+
+# Запрос зашит в custom_id кнопок листания, а тот не длиннее 100 символов
+SEARCH_QUERY_MAX_LENGTH = 80
+SEARCH_SNIPPET_LENGTH = 900
+
+async def build_search_page(guild_id, query, days, page):
+    """Собирает embed одной страницы /search_rollbacks; возвращает embed и признак следующей страницы"""
+    since = datetime.now() - timedelta(days=days) if days else None
+    matches, has_more = await search_rollbacks(guild_id, query, since, page)
+    
+    embed = disnake.Embed(title=f"🔎 Поиск откатов: {query}", color=0x2b2d31)
+    for match in matches:
+        embed.add_field(
+            name=f"{match.user_name} — {match.list_name} (ID: {match.list_id})"[:256],
+            value=f"{match.snippet[:SEARCH_SNIPPET_LENGTH]}\n{match.timestamp:%d.%m.%Y %H:%M}",
+            inline=False
+        )
+    
+    period = f" | За {days} дн." if days else ""
+    embed.set_footer(text=f"Страница {page + 1}{period}")
+    return embed, has_more
+
+def search_page_components(query, days, page, has_more):
+    """Кнопки листания /search_rollbacks: страница, период и запрос зашиты в custom_id"""
+    return [
+        disnake.ui.Button(label="◀ Назад", style=disnake.ButtonStyle.secondary,
+                          custom_id=button_id("search", f"{page - 1}:{days}:{query}"), disabled=page <= 0),
+        disnake.ui.Button(label="Вперёд ▶", style=disnake.ButtonStyle.secondary,
+                          custom_id=button_id("search", f"{page + 1}:{days}:{query}"), disabled=not has_more),
+    ]
+
+@button_handler("search")
+async def search_page_button(inter: disnake.MessageInteraction, arg):
+    page, _, rest = arg.partition(":")
+    days, _, query = rest.partition(":")
+    page, days = max(0, int(page)), int(days)
+    embed, has_more = await build_search_page(inter.guild_id, query, days, page)
+    await replace_reply(inter, embed=embed, components=search_page_components(query, days, page, has_more))
+
+@bot.slash_command(name="search_rollbacks", description="Найти откаты по словам во всех списках сервера")
+async def search_rollbacks_command(
+    inter: disnake.ApplicationCommandInteraction,
+    query: str = commands.Param(description="Слова для поиска", max_length=SEARCH_QUERY_MAX_LENGTH),
+    days: int = commands.Param(default=0, ge=0, le=3650, description="За сколько последних дней (0 - за всё время)")
+):
+    if not is_admin(inter.author):
+        await reply(inter, "❌ У вас нет прав для выполнения этой команды!")
+        return
+    
+    query = query.strip()
+    embed, has_more = await build_search_page(inter.guild.id, query, days, 0)
+    
+    if not embed.fields:
+        await reply(inter, "🔎 Ничего не найдено!")
+        return
+    
+    if has_more:
+        await reply(inter, embed=embed, components=search_page_components(query, days, 0, has_more))
+    else:
+        await reply(inter, embed=embed)
+
+@bot.slash_command(description="Посмотреть все списки")
+async def list_all(
+    inter: disnake.ApplicationCommandInteraction,
+    page: int = commands.Param(default=1, ge=1, description="Номер страницы")
+):
+    if not is_admin(inter.author):
+        await reply(inter, "❌ У вас нет прав для выполнения этой команды!")
+        return
+    
+    embed, total, total_pages = await build_lists_page(inter.guild.id, page - 1)
+    
+    if not total:
+        await reply(inter, "📋 Списков пока нет!")
+        return
+    
+    page = min(page - 1, total_pages - 1)
+    if page != 0 and not embed.fields:
+        # Запрошена страница за пределами - показываем последнюю
+        embed, total, total_pages = await build_lists_page(inter.guild.id, page)
+    
+    if total_pages > 1:
+        await reply(inter, embed=embed, components=lists_page_components(page, total_pages))
+    else:
+        await reply(inter, embed=embed)
 
 if __name__ == "__main__":
     # Инициализируем БД
-    init_db()
+    storage.init()
+    load_guild_configs()
     
     token = os.getenv("DISCORD_BOT_TOKEN")
     if not token:
@@ -974,4 +3422,6 @@ if __name__ == "__main__":
             bot.run(token)
         except Exception as e:
             print(f"❌ Ошибка при запуске бота: {e}")
-            input("Нажмите Enter для выхода...")
\ No newline at end of file
+            input("Нажмите Enter для выхода...")
+        finally:
+            storage.close()
\ No newline at end of file
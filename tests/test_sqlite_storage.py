@@ -0,0 +1,118 @@
+"""Поведение хранилища на встроенном SQLite: без сервера БД и без Discord.
+
+Запуск из корня репозитория:
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot1
+
+GUILD_ID = 1
+OTHER_GUILD_ID = 2
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = bot1.SQLiteStorage(str(tmp_path / "rollback_bot.db"))
+    storage.init()
+    yield storage
+    storage.close()
+
+def create_list(storage, list_id, guild_id=GUILD_ID, name=None):
+    return storage.create_new_list(list_id, name or f"Список {list_id}", 10, 20, "0", guild_id)
+
+def register(storage, list_id, user_ids):
+    return storage.register_participants(list_id, [(user_id, f"Участник {user_id}") for user_id in user_ids])
+
+def test_register_participants_skips_duplicates(storage):
+    create_list(storage, "L1")
+    first = register(storage, "L1", ["1", "2"])
+    second = register(storage, "L1", ["2", "3", "3"])
+    
+    assert [p.user_id for p in first] == ["1", "2"]
+    assert [p.user_id for p in second] == ["3"]
+    assert list(storage.get_list("L1", GUILD_ID).participants) == ["1", "2", "3"]
+    assert storage.register_participant("L1", "1", "Участник 1") is None
+
+def test_register_participants_on_deleted_list(storage):
+    create_list(storage, "L1")
+    storage.delete_list_from_db("L1")
+    
+    assert storage.register_participants("L1", [("1", "Участник 1")]) is None
+    assert storage.register_participant("L1", "1", "Участник 1") is None
+
+def test_chunk_slots_are_stable_and_reused(storage):
+    create_list(storage, "L1")
+    size = bot1.STATUS_CHUNK_SIZE
+    register(storage, "L1", [str(i) for i in range(size * 2 + 1)])
+    chunks = {p.user_id: p.chunk_index for p in storage.get_list("L1", GUILD_ID).participants.values()}
+    assert chunks["0"] == 1 and chunks[str(size)] == 2 and chunks[str(size * 2)] == 3
+    
+    # Уход участника не сдвигает остальных
+    assert storage.remove_participant("L1", "0")
+    after = {p.user_id: p.chunk_index for p in storage.get_list("L1", GUILD_ID).participants.values()}
+    assert after == {user_id: chunk for user_id, chunk in chunks.items() if user_id != "0"}
+    
+    # Освободившееся место достаётся следующему, затем заполняется последний блок
+    new = register(storage, "L1", ["new1", "new2"])
+    assert [p.chunk_index for p in new] == [1, 3]
+
+def test_replace_rollback_requires_registration(storage):
+    create_list(storage, "L1")
+    register(storage, "L1", ["1"])
+    
+    assert storage.replace_rollback("L1", "2", "Чужой", "текст") is None
+    assert storage.get_list("L1", GUILD_ID).rollbacks == []
+    
+    storage.replace_rollback("L1", "1", "Участник 1", "первый")
+    storage.replace_rollback("L1", "1", "Участник 1", "второй")
+    list_data = storage.get_list("L1", GUILD_ID)
+    assert [r.text for r in list_data.rollbacks] == ["второй"]
+    assert list_data.participants["1"].has_rollback
+    
+    assert storage.remove_user_rollback("L1", "1")
+    assert not storage.remove_user_rollback("L1", "1")
+    assert not storage.get_list("L1", GUILD_ID).participants["1"].has_rollback
+
+def test_get_all_lists_pages(storage):
+    for i in range(5):
+        create_list(storage, f"L{i}")
+        register(storage, f"L{i}", [str(u) for u in range(i)])
+    storage.replace_rollback("L3", "0", "Участник 0", "текст")
+    create_list(storage, "OTHER", guild_id=OTHER_GUILD_ID)
+    
+    first, total = storage.get_all_lists(GUILD_ID, page=0, page_size=2)
+    assert total == 5
+    assert [(s.id, s.participants_count, s.rollbacks_count) for s in first] == [("L4", 4, 0), ("L3", 3, 1)]
+    
+    last, total = storage.get_all_lists(GUILD_ID, page=2, page_size=2)
+    assert total == 5 and [s.id for s in last] == ["L0"]
+    assert storage.get_all_lists(GUILD_ID, page=3, page_size=2) == ([], 5)
+
+def test_search_rollbacks(storage):
+    create_list(storage, "L1", name="Битва у замка")
+    create_list(storage, "OTHER", guild_id=OTHER_GUILD_ID)
+    register(storage, "L1", [str(i) for i in range(3)])
+    register(storage, "OTHER", ["1"])
+    for i in range(3):
+        storage.replace_rollback("L1", str(i), f"Участник {i}", f"катапульты на левом фланге {i}")
+    storage.replace_rollback("OTHER", "1", "Участник 1", "катапульты на чужом сервере")
+    
+    matches, has_more = storage.search_rollbacks(GUILD_ID, "катапульты", page_size=2)
+    assert len(matches) == 2 and has_more
+    assert all(match.list_id == "L1" and match.list_name == "Битва у замка" for match in matches)
+    
+    matches, has_more = storage.search_rollbacks(GUILD_ID, "катапульты", page=1, page_size=2)
+    assert len(matches) == 1 and not has_more
+    
+    # Заменённый откат больше не находится по старому тексту
+    storage.replace_rollback("L1", "0", "Участник 0", "драконы")
+    assert len(storage.search_rollbacks(GUILD_ID, "катапульты")[0]) == 2
+    assert [m.user_name for m in storage.search_rollbacks(GUILD_ID, "драконы")[0]] == ["Участник 0"]
+    
+    # Мусорный запрос не ломает разбор FTS5
+    assert storage.search_rollbacks(GUILD_ID, '"" OR ) *') == ([], False)